@@ -47,6 +47,7 @@ INSTALLED_APPS = [
 		'profiles.apps.ProfilesConfig',
 		'stock_track.apps.StockTrackConfig',
 		'sales.apps.SalesConfig',
+		'email_tasks.apps.EmailTasksConfig',
 
 		'widget_tweaks',
 		"django_q",
@@ -212,5 +213,64 @@ AUTHENTICATION_BACKENDS = (
     'allauth.account.auth_backends.AuthenticationBackend',
 )
 
+# Order in which sales consume stock: "fefo" (earliest expiry first) or "fifo" (earliest manufacture first)
+STOCK_ALLOCATION_STRATEGY = "fefo"
+
+# Whether sales may take stock from batches past their expiry date
+SELL_EXPIRED_STOCK = False
+
+# Goods receipt lines upserted per statement
+RECEIPT_CHUNK_SIZE = 1000
+
+# Spreadsheet rows imported per transaction
+IMPORT_CHUNK_SIZE = 2000
+
+# Minimum seconds between inventory snapshot runs; the scheduled task skips runs that come sooner
+INVENTORY_SNAPSHOT_INTERVAL = 24 * 60 * 60
+# Seconds a snapshot lags behind now, so every log created up to its time has committed
+INVENTORY_SNAPSHOT_SETTLE_SECONDS = 60
+
+# Number of offline POS sales committed per transaction by the batch sync endpoint
+SALES_SYNC_CHUNK_SIZE = 200
+
+# Number of co-purchased neighbours stored per product in the recommendation index
+RECOMMENDATION_TOP_K = 10
+
+# EmailTask dispatcher: tasks claimed per batch, seconds before an abandoned claim can be
+# taken over, attempts before a task is marked failed and base seconds of the retry backoff
+EMAIL_TASK_BATCH_SIZE = 50
+EMAIL_TASK_CLAIM_TIMEOUT = 600
+EMAIL_TASK_MAX_ATTEMPTS = 5
+EMAIL_TASK_RETRY_BACKOFF = 60
+
+# How EmailTasks are delivered: "pooled" (one blocking SMTP session per owner and batch) or "async"
+# (EMAIL_ASYNC_POOL_SIZE concurrent SMTP sessions per owner, needs aiosmtplib)
+EMAIL_DELIVERY_ENGINE = "pooled"
+EMAIL_ASYNC_POOL_SIZE = 4
+
+# Send rate budget of every sending account (each owner's address and EMAIL_HOST_USER),
+# shared by all workers: sustained messages per minute and the largest burst
+EMAIL_RATE_LIMIT_PER_MINUTE = 20
+EMAIL_RATE_LIMIT_BURST = 20
+
+# run_email_scheduler: due times kept in memory, and seconds between full resyncs with the database
+EMAIL_SCHEDULER_HEAP_SIZE = 100
+EMAIL_SCHEDULER_RESYNC_SECONDS = 900
+
+# run_outbox_sender: sending threads, messages claimed per batch, claimed batches buffered in memory,
+# seconds between checks for retries when idle and seconds between metrics reports
+# (retries, backoff and claim timeout follow the EMAIL_TASK_* settings)
+OUTBOX_CONCURRENCY = 4
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_BUFFER_BATCHES = 8
+OUTBOX_POLL_SECONDS = 5
+OUTBOX_METRICS_INTERVAL = 60
+
+# Send one summary email per owner per alert run instead of one email per alert
+INVENTORY_ALERT_DIGEST = True
+
+# Change feed consumers: rows read per page
+CHANGE_FEED_PAGE_SIZE = 500
+
 LOGIN_REDIRECT_URL = 'profiles:cstm_login_redirect'
 # LOGOUT_REDIRECT_URL = 'main:index'
@@ -0,0 +1,15 @@
+from django.contrib import admin
+from .models import *
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('to_email', 'subject', 'status', 'attempts', 'available_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to_email', 'subject')
+
+
+@admin.register(SendRateBucket)
+class SendRateBucketAdmin(admin.ModelAdmin):
+    list_display = ('account', 'tokens', 'updated_at')
+    search_fields = ('account',)
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class EmailTasksConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'email_tasks'
+    verbose_name = "Email Outbox"
+
+    def ready(self):
+        from . import signals  # noqa: F401
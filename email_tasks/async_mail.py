@@ -0,0 +1,105 @@
+import asyncio
+
+import aiosmtplib
+from django.conf import settings
+
+# Failures that concern a single message; the SMTP session itself is still usable
+MESSAGE_ERRORS = (
+    aiosmtplib.SMTPRecipientsRefused,
+    aiosmtplib.SMTPRecipientRefused,
+    aiosmtplib.SMTPSenderRefused,
+    aiosmtplib.SMTPDataError,
+)
+
+
+class SMTPSessionPool:
+    """
+    Up to `size` persistent SMTP sessions logged in as one account. Messages are handed to
+    whichever session frees up first, so a wave goes out `size` messages at a time.
+    Sessions are opened lazily and reopened when they break.
+    """
+
+    def __init__(self, username, password, size):
+        self.username = username
+        self.password = password
+        self.sessions = asyncio.Queue()
+        for _ in range(size):
+            self.sessions.put_nowait(None)
+
+    async def connect(self):
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.EMAIL_HOST,
+            port=settings.EMAIL_PORT,
+            use_tls=getattr(settings, 'EMAIL_USE_SSL', False),
+            start_tls=settings.EMAIL_USE_TLS,
+            timeout=getattr(settings, 'EMAIL_TIMEOUT', None),
+        )
+        await smtp.connect()
+        if self.username:
+            await smtp.login(self.username, self.password or "")
+        return smtp
+
+    async def send(self, message, retries=1):
+        """
+        Sends one Django EmailMessage; returns None when sent, else the error.
+        """
+        smtp = await self.sessions.get()
+        error = None
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    if smtp is None:
+                        smtp = await self.connect()
+                    await smtp.send_message(
+                        message.message(), sender=message.from_email, recipients=message.recipients()
+                    )
+                    return None
+                except MESSAGE_ERRORS as e:
+                    return e
+                except (aiosmtplib.SMTPException, OSError) as e:
+                    error = e
+                    # Drop the broken session, the next attempt reconnects
+                    if smtp is not None:
+                        smtp.close()
+                    smtp = None
+            return error
+        finally:
+            self.sessions.put_nowait(smtp)
+
+    async def close(self):
+        while not self.sessions.empty():
+            smtp = self.sessions.get_nowait()
+            if smtp is not None:
+                try:
+                    await smtp.quit()
+                except (aiosmtplib.SMTPException, OSError):
+                    smtp.close()
+
+
+async def deliver(batches, pool_size):
+    pools = {}
+    waves = []
+    for username, password, messages in batches:
+        pool = pools.get((username, password))
+        if pool is None:
+            pool = pools[(username, password)] = SMTPSessionPool(username, password, pool_size)
+        waves.append(asyncio.gather(*(pool.send(message) for message in messages)))
+    try:
+        return [list(results) for results in await asyncio.gather(*waves)]
+    finally:
+        await asyncio.gather(*(pool.close() for pool in pools.values()))
+
+
+def send_messages_async(batches, pool_size=None):
+    """
+    Sends (username, password, messages) batches concurrently over a bounded pool of
+    EMAIL_ASYNC_POOL_SIZE persistent SMTP sessions per account (EMAIL_HOST_USER when username
+    is None). Returns one result list per batch, aligned with its messages: None for a sent
+    message, else the error.
+    """
+    pool_size = pool_size or settings.EMAIL_ASYNC_POOL_SIZE
+    batches = [
+        (username or settings.EMAIL_HOST_USER, password if username else settings.EMAIL_HOST_PASSWORD, messages)
+        for username, password, messages in batches
+    ]
+    return asyncio.run(deliver(batches, pool_size))
@@ -0,0 +1,57 @@
+from collections import defaultdict
+from typing import NamedTuple
+
+from django.contrib.auth import get_user_model
+
+
+class Alert(NamedTuple):
+    """
+    One alert condition found by a notification run.
+    """
+    company_owner_id: int
+    section: str  # Heading the alert is listed under in a digest
+    subject: str  # Subject of the alert when it is emailed on its own
+    message: str
+
+
+def build_notifications(alerts, digest, digest_subject):
+    """
+    Turns alerts into (company_owner, email_subject, email_body) notifications.
+
+    With `digest` every owner gets a single summary email listing all of their alerts by
+    section; otherwise every alert becomes its own email. The owners are fetched in one query.
+    """
+    alerts = list(alerts)
+    owners = (
+        get_user_model().objects.only('id', 'username', 'email')
+        .in_bulk({alert.company_owner_id for alert in alerts})
+    )
+
+    if not digest:
+        return [
+            (
+                owners[alert.company_owner_id],
+                alert.subject,
+                f"Dear {owners[alert.company_owner_id].username},\n\n{alert.message}\n\nThank you.",
+            )
+            for alert in alerts
+        ]
+
+    sections_by_owner = defaultdict(lambda: defaultdict(list))
+    for alert in alerts:
+        sections_by_owner[alert.company_owner_id][alert.section].append(alert.message)
+
+    notifications = []
+    for owner_id, sections in sections_by_owner.items():
+        owner = owners[owner_id]
+        count = sum(len(messages) for messages in sections.values())
+        body = "".join(
+            f"{section} ({len(messages)}):\n" + "\n".join(f"- {message}" for message in messages) + "\n\n"
+            for section, messages in sections.items()
+        )
+        notifications.append((
+            owner,
+            f"{digest_subject} ({count} alert{'s' if count != 1 else ''})",
+            f"Dear {owner.username},\n\n{body}Thank you.",
+        ))
+    return notifications
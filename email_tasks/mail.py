@@ -0,0 +1,44 @@
+import smtplib
+
+from django.core.mail import get_connection
+
+# Failures that concern a single message; the SMTP session itself is still usable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+def send_messages_pooled(messages, username=None, password=None, retries=1):
+    """
+    Sends EmailMessages through a single SMTP session authenticated as `username`
+    (EMAIL_HOST_USER when omitted), instead of one connect/TLS/login round per message.
+
+    If the session breaks, it is reopened and the failing message is retried up to `retries`
+    times. Returns a list aligned with `messages`: None for a sent message, else the error.
+    """
+    results = [None] * len(messages)
+    connection = None
+    try:
+        for index, message in enumerate(messages):
+            for attempt in range(retries + 1):
+                try:
+                    if connection is None:
+                        connection = get_connection(username=username, password=password, fail_silently=False)
+                        connection.open()
+                    message.connection = connection
+                    connection.send_messages([message])
+                    results[index] = None
+                    break
+                except MESSAGE_ERRORS as e:
+                    results[index] = e
+                    break
+                except (smtplib.SMTPException, OSError) as e:
+                    results[index] = e
+                    # Drop the broken session, the next attempt reconnects
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                    connection = None
+    finally:
+        if connection is not None:
+            connection.close()
+    return results
@@ -0,0 +1,133 @@
+import queue
+import select
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from email_tasks.outbox import OUTBOX_CHANNEL, claim_outbox_messages, outbox_stats, send_outbox_messages
+
+
+class SenderMetrics:
+    """
+    Thread-safe counters of one sender process.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = self.failed = self.batches = 0
+        self.send_seconds = 0.0
+
+    def record(self, total, sent, seconds):
+        with self.lock:
+            self.sent += sent
+            self.failed += total - sent
+            self.batches += 1
+            self.send_seconds += seconds
+
+    def summary(self):
+        with self.lock:
+            finished = self.sent + self.failed
+            return (
+                f"sent {self.sent}, failed {self.failed}, "
+                f"failure rate {self.failed / finished if finished else 0:.1%}, "
+                f"average SMTP time per batch {self.send_seconds / self.batches if self.batches else 0:.2f}s"
+            )
+
+
+class Command(BaseCommand):
+    help = (
+        "Sends queued OutboxMessages with a fixed pool of workers and a bounded buffer. "
+        "On SIGTERM/SIGINT it stops claiming and drains the buffered messages before exiting."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, help="Sending threads (default: OUTBOX_CONCURRENCY).")
+        parser.add_argument("--buffer", type=int, help="Claimed batches held in memory (default: OUTBOX_BUFFER_BATCHES).")
+        parser.add_argument("--batch-size", type=int, help="Messages claimed per batch (default: OUTBOX_BATCH_SIZE).")
+        parser.add_argument("--stats", action="store_true", help="Print the outbox metrics and exit.")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for name, value in outbox_stats().items():
+                self.stdout.write(f"{name}: {value}")
+            return
+
+        concurrency = options['concurrency'] or settings.OUTBOX_CONCURRENCY
+        batch_size = options['batch_size'] or settings.OUTBOX_BATCH_SIZE
+        buffer = queue.Queue(maxsize=options['buffer'] or settings.OUTBOX_BUFFER_BATCHES)
+        metrics = SenderMetrics()
+
+        self.stopping = threading.Event()
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        workers = [
+            threading.Thread(target=self.work, args=(buffer, metrics), name=f"outbox-sender-{number}")
+            for number in range(concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {OUTBOX_CHANNEL}")
+        listener = connection.connection
+        self.stdout.write(f"Outbox sender running with {concurrency} worker(s).")
+
+        next_report = time.monotonic() + settings.OUTBOX_METRICS_INTERVAL
+        while not self.stopping.is_set():
+            if time.monotonic() >= next_report:
+                self.report(buffer, metrics)
+                next_report = time.monotonic() + settings.OUTBOX_METRICS_INTERVAL
+
+            messages = claim_outbox_messages(batch_size)
+            if messages:
+                # Blocks while the buffer is full, so claiming never runs ahead of sending
+                buffer.put(messages)
+                continue
+
+            # Nothing sendable: wait for a NOTIFY, or re-check for retries becoming available.
+            # A notification that arrived during the claim query is already read off the socket,
+            # so claim again right away instead of waiting for the socket to become readable
+            if not listener.notifies:
+                readable, _, _ = select.select([listener], [], [], settings.OUTBOX_POLL_SECONDS)
+                if readable:
+                    listener.poll()
+            listener.notifies.clear()
+
+        # Graceful drain: the buffered batches are already claimed, send them before exiting
+        self.stdout.write(f"Draining {buffer.qsize()} buffered batch(es)...")
+        for _ in workers:
+            buffer.put(None)
+        for worker in workers:
+            worker.join()
+        self.report(buffer, metrics)
+        self.stdout.write("Outbox sender stopped.")
+
+    def stop(self, signum, frame):
+        self.stopping.set()
+
+    def work(self, buffer, metrics):
+        try:
+            while True:
+                messages = buffer.get()
+                if messages is None:
+                    break
+                started = time.monotonic()
+                sent = send_outbox_messages(messages)
+                metrics.record(len(messages), sent, time.monotonic() - started)
+        finally:
+            # Every thread has its own database connection
+            connection.close()
+
+    def report(self, buffer, metrics):
+        stats = outbox_stats()
+        self.stdout.write(
+            f"Outbox: depth {stats['queue_depth']} ({buffer.qsize()} batch(es) buffered), "
+            f"oldest {stats['oldest_pending_seconds']:.0f}s, "
+            f"latency {stats['average_latency_seconds']:.1f}s, "
+            f"failure rate {stats['failure_rate']:.1%} (last hour). This process: {metrics.summary()}"
+        )
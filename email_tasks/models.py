@@ -0,0 +1,52 @@
+from django.db import models
+from django.db.models import Q
+
+
+class OutboxMessage(models.Model):
+    """
+    A notification email waiting to be sent by the outbox sender (run_outbox_sender).
+    Writing a row is all a request or task pays for; the message survives worker restarts.
+    """
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("claimed", "Claimed"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    ]
+    to_email = models.EmailField(verbose_name="To")
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(verbose_name="Available At")
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.subject} to {self.to_email} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at'], name='outbox_pending', condition=Q(status="pending")),
+            models.Index(fields=['claimed_at'], name='outbox_claimed', condition=Q(status="claimed")),
+            models.Index(fields=['status', 'updated_at'], name='outbox_status_updated'),
+        ]
+
+
+class SendRateBucket(models.Model):
+    """
+    Token bucket of one sending account, shared by every worker through this row: tokens refill
+    at EMAIL_RATE_LIMIT_PER_MINUTE up to EMAIL_RATE_LIMIT_BURST, and each message takes one.
+    next_free_at is the last send slot handed out to a deferred message, so deferred messages
+    of concurrent workers are spread over distinct slots.
+    """
+    account = models.CharField(max_length=254, unique=True)
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+    next_free_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.account} ({self.tokens:.1f} tokens)"
@@ -0,0 +1,137 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import connection, transaction
+from django.db.models import Avg, Count, F, Min, Q
+from django.utils import timezone
+
+from .mail import send_messages_pooled
+from .models import OutboxMessage
+from .ratelimit import take_send_tokens
+
+# Postgres channel the outbox sender (run_outbox_sender) listens on
+OUTBOX_CHANNEL = "outbox"
+
+
+def enqueue_notifications(notifications):
+    """
+    Queues (company_owner, email_subject, email_body) notifications in the outbox with a single
+    insert. Called inside a transaction, the messages are only sent if it commits; the sender is
+    woken through NOTIFY, which Postgres also only delivers on commit. Returns the messages.
+    """
+    now_time = timezone.now()
+    messages = OutboxMessage.objects.bulk_create([
+        OutboxMessage(to_email=company_owner.email, subject=email_subject, body=email_body, available_at=now_time)
+        for company_owner, email_subject, email_body in notifications
+    ])
+    if messages:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, '')", [OUTBOX_CHANNEL])
+    return messages
+
+
+def claim_outbox_messages(batch_size=None):
+    """
+    Claims a batch of sendable OutboxMessages with SELECT ... FOR UPDATE SKIP LOCKED, so several
+    senders can drain the outbox in parallel. Claims of a crashed sender are taken over after
+    EMAIL_TASK_CLAIM_TIMEOUT.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    now_time = timezone.now()
+    stale_claim = now_time - timedelta(seconds=settings.EMAIL_TASK_CLAIM_TIMEOUT)
+
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(Q(status="pending", available_at__lte=now_time) | Q(status="claimed", claimed_at__lt=stale_claim))
+            .order_by('available_at')[:batch_size]
+        )
+        OutboxMessage.objects.filter(pk__in=[message.pk for message in messages]).update(
+            status="claimed", claimed_at=now_time, updated_at=now_time
+        )
+    return messages
+
+
+def send_outbox_messages(messages):
+    """
+    Sends claimed OutboxMessages from EMAIL_HOST_USER through one pooled SMTP session and records
+    the outcome of each. Messages beyond the account's send rate budget are put back, without
+    counting an attempt, for when the budget allows them. Returns the number of sent messages.
+    """
+    granted, later = take_send_tokens(settings.EMAIL_HOST_USER, len(messages))
+    for message, when in zip(messages[granted:], later):
+        message.status = "pending"
+        message.available_at = when
+    OutboxMessage.objects.bulk_update(messages[granted:], ['status', 'available_at'])
+    messages = messages[:granted]
+
+    results = send_messages_pooled([
+        EmailMessage(
+            subject=message.subject,
+            body=message.body,
+            from_email=settings.EMAIL_HOST_USER,
+            to=[message.to_email],
+        )
+        for message in messages
+    ])
+
+    now_time = timezone.now()
+    sent_ids = [message.pk for message, error in zip(messages, results) if error is None]
+    OutboxMessage.objects.filter(pk__in=sent_ids, status="claimed").update(
+        status="sent", attempts=F('attempts') + 1, sent_at=now_time, last_error=None, updated_at=now_time
+    )
+    for message, error in zip(messages, results):
+        if error is not None:
+            mark_outbox_message_failed(message, error)
+    return len(sent_ids)
+
+
+def mark_outbox_message_failed(message, error):
+    """
+    Puts a failed message back in the outbox with exponential backoff, or marks it as failed
+    for good once it has used up EMAIL_TASK_MAX_ATTEMPTS.
+    """
+    now_time = timezone.now()
+    attempts = message.attempts + 1
+    status = "failed" if attempts >= settings.EMAIL_TASK_MAX_ATTEMPTS else "pending"
+    backoff = settings.EMAIL_TASK_RETRY_BACKOFF * 2 ** (attempts - 1)
+    OutboxMessage.objects.filter(pk=message.pk, status="claimed").update(
+        status=status,
+        attempts=attempts,
+        last_error=str(error),
+        available_at=now_time + timedelta(seconds=backoff),
+        updated_at=now_time,
+    )
+
+
+def outbox_stats(window=None):
+    """
+    Health of the outbox: queue depth, age of the oldest sendable message, and the sent/failed
+    counts, failure rate and average enqueue-to-send latency over the last `window`.
+    """
+    window = window or timedelta(hours=1)
+    now_time = timezone.now()
+    since = now_time - window
+
+    queue = OutboxMessage.objects.filter(status__in=("pending", "claimed")).aggregate(
+        depth=Count('id'),
+        retrying=Count('id', filter=Q(attempts__gt=0)),
+        oldest=Min('available_at', filter=Q(status="pending", available_at__lte=now_time)),
+    )
+    recent = OutboxMessage.objects.filter(status__in=("sent", "failed"), updated_at__gte=since).aggregate(
+        sent=Count('id', filter=Q(status="sent")),
+        failed=Count('id', filter=Q(status="failed")),
+        latency=Avg(F('sent_at') - F('created_at'), filter=Q(status="sent")),
+    )
+
+    finished = recent['sent'] + recent['failed']
+    return {
+        "queue_depth": queue['depth'],
+        "retrying": queue['retrying'],
+        "oldest_pending_seconds": (now_time - queue['oldest']).total_seconds() if queue['oldest'] else 0,
+        "sent": recent['sent'],
+        "failed": recent['failed'],
+        "failure_rate": recent['failed'] / finished if finished else 0.0,
+        "average_latency_seconds": recent['latency'].total_seconds() if recent['latency'] else 0.0,
+    }
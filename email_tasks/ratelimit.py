@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SendRateBucket
+
+
+def take_send_tokens(account, count):
+    """
+    Takes up to `count` tokens from the sending account's bucket. The bucket row is locked while
+    it is refilled and drawn from, so all workers share one budget per account.
+
+    Returns (granted, later): the number of messages that may be sent now, and for each of the
+    other `count - granted` messages the time at which it fits in the account's budget. Those
+    times come after the slots already handed out by earlier calls (the bucket's next_free_at),
+    so messages deferred by concurrent workers never share a slot.
+    """
+    rate = settings.EMAIL_RATE_LIMIT_PER_MINUTE / 60
+    burst = settings.EMAIL_RATE_LIMIT_BURST
+    account = account.lower()
+    now_time = timezone.now()
+
+    later = []
+    with transaction.atomic():
+        SendRateBucket.objects.get_or_create(account=account, defaults={'tokens': burst, 'updated_at': now_time})
+        bucket = SendRateBucket.objects.select_for_update().get(account=account)
+        elapsed = max((now_time - bucket.updated_at).total_seconds(), 0)
+        tokens = min(burst, bucket.tokens + elapsed * rate)
+        granted = min(count, int(tokens))
+        bucket.tokens = tokens - granted
+        bucket.updated_at = now_time
+
+        for position in range(count - granted):
+            when = now_time + timedelta(seconds=(position + 1 - bucket.tokens) / rate)
+            if bucket.next_free_at and when <= bucket.next_free_at:
+                when = bucket.next_free_at + timedelta(seconds=1 / rate)
+            later.append(when)
+            bucket.next_free_at = when
+        bucket.save(update_fields=['tokens', 'updated_at', 'next_free_at'])
+
+    return granted, later
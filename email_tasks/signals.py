@@ -0,0 +1,23 @@
+from django.db.models import Value
+from django.db.models.functions import Replace
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+# The scheduled task functions used to live among the management commands
+OLD_TASK_PREFIX = "email_tasks.management.commands."
+TASK_PREFIX = "email_tasks.tasks."
+
+
+@receiver(post_migrate)
+def move_task_schedules(sender, app_config=None, **kwargs):
+    """
+    Points django-q schedules that still name a task function by its old module path at
+    email_tasks.tasks, so existing schedules keep running after the move.
+    """
+    if app_config is None or app_config.label != 'email_tasks':
+        return
+    from django_q.models import Schedule
+
+    Schedule.objects.filter(func__startswith=OLD_TASK_PREFIX).update(
+        func=Replace('func', Value(OLD_TASK_PREFIX), Value(TASK_PREFIX))
+    )
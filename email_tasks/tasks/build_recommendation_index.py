@@ -0,0 +1,15 @@
+from sales.models import Sale
+from sales.recommendations import build_recommendation_index
+
+
+def build_recommendation_indexes(task=None):
+    """
+    Rebuilds the co-purchase recommendation index of every company owner with sales.
+    Meant to run offline (e.g. nightly) ahead of the 30-day recommendation emails.
+    """
+    owner_ids = Sale.objects.values_list('company_owner_id', flat=True).distinct()
+    for owner_id in owner_ids:
+        rows = build_recommendation_index(owner_id)
+        print(f"Built {rows} recommendations for owner {owner_id}.")
+
+    print("Recommendation indexes rebuilt successfully.")
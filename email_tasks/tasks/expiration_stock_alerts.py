@@ -0,0 +1,98 @@
+from stock_track.models import Batch
+from stock_track.alerts import AlertCondition, fingerprint, record_transitions
+from stock_track.change_feed import lock_cursor
+from stock_track.snapshots import snapshot_time
+from email_tasks.digest import Alert, build_notifications
+from email_tasks.outbox import enqueue_notifications
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import now, timedelta
+
+
+def _batch_conditions(alert_type, batches, subject, title, message):
+    return [
+        AlertCondition(
+            fingerprint(alert_type, batch['id'], batch['expiry_date']),
+            alert_type, batch['company_owner_id'], batch['id'], str(batch['expiry_date']),
+            Alert(
+                batch['company_owner_id'],
+                subject,
+                title.format(**batch),
+                message.format(**batch),
+            ),
+        )
+        for batch in batches
+    ]
+
+
+def expiration_stock_alerts(task=None, digest=None):
+    """
+    Function to send batch expiry email notifications.
+    This function handles the following notifications:
+    - Batch Expiration Reminder
+    - Expired Batch Alert
+
+    A run only evaluates the batches that can have changed state since the previous one: those
+    expiring within 7 days, those that expired since the last run and those saved since then,
+    so its cost doesn't grow with the history of expired batches. Alerts are only sent when a
+    condition is newly raised (tracked in AlertState), so a batch is alerted once per expiry
+    date, and the expiring alert of a batch is cleared once it leaves the window.
+    Low and out-of-stock alerts are sent by stock_threshold_alerts as the stock changes.
+    In digest mode (INVENTORY_ALERT_DIGEST) every owner gets one summary email per run.
+    """
+    digest = settings.INVENTORY_ALERT_DIGEST if digest is None else digest
+    alerts = []
+    # Batches saved by transactions still open now have an earlier updated_at, so the next run
+    # looks back to before the oldest of them
+    watermark = snapshot_time()
+    # Get today's date and calculate one week from now
+    today = now().date()
+    one_week_from_now = today + timedelta(days=7)
+
+    with transaction.atomic():
+        # Held for the run, so two overlapping runs can't both raise the same alerts
+        cursor = lock_cursor("expiration_stock_alerts")
+
+        window = Q(expiry_date__gte=today, expiry_date__lte=one_week_from_now)
+        if cursor.last_seen_at is None:
+            window |= Q(expiry_date__lt=today)
+        else:
+            since = cursor.last_seen_at
+            window |= Q(expiry_date__gte=since.date(), expiry_date__lt=today) | Q(updated_at__gte=since)
+        batches = list(Batch.objects.filter(window).values('id', 'company_owner_id', 'batch_number', 'expiry_date'))
+        batch_ids = [batch['id'] for batch in batches]
+
+        # 1. Batch Expiration Reminder: batches within 7 days of expiry
+        alerts.extend(record_transitions(
+            ["batch_expiring"],
+            batch_ids,
+            _batch_conditions(
+                "batch_expiring",
+                [batch for batch in batches if batch['expiry_date'] and today <= batch['expiry_date'] <= one_week_from_now],
+                "Batches expiring within 7 days",
+                "Batch Expiration Reminder: Batch {batch_number}",
+                "Batch {batch_number} of product(s) in your inventory will expire on {expiry_date}.",
+            ),
+        ))
+
+        # 2. Expired Batch Alert: batches whose expiry date has passed
+        alerts.extend(record_transitions(
+            ["batch_expired"],
+            batch_ids,
+            _batch_conditions(
+                "batch_expired",
+                [batch for batch in batches if batch['expiry_date'] and batch['expiry_date'] < today],
+                "Expired batches",
+                "Expired Batch Alert: Batch {batch_number}",
+                "Batch {batch_number} of product(s) in your inventory has expired. Please take necessary action.",
+            ),
+        ))
+
+        cursor.last_seen_at = watermark
+        cursor.save()
+
+        notifications = build_notifications(alerts, digest, "Inventory Alerts")
+        enqueue_notifications(notifications)
+
+    print(f"Inventory notifications sent successfully ({len(alerts)} new alert(s)).")
@@ -0,0 +1,100 @@
+from stock_track.models import Inventory, InventoryLog
+from stock_track.change_feed import consume_changes
+from email_tasks.digest import Alert, build_notifications
+from email_tasks.outbox import enqueue_notifications
+from django.conf import settings
+
+
+
+
+def _send_page_alerts(alerts, digest, digest_subject):
+    enqueue_notifications(build_notifications(alerts, digest, digest_subject))
+
+
+def inventory_management_notifications(task=None, digest=None):
+    """
+    Function to send inventory-related email notifications.
+    This function handles the following notifications:
+    - New Inventory Added
+    - Inventory Transfer Alert
+    - Inventory Log Change
+
+    New inventory and log changes are read from a change feed: a durable per-consumer cursor
+    over the inserting transaction and row ids, so every row is notified exactly once however
+    late or often this runs. Rows running out are notified once, as out-of-stock alerts, by
+    stock_threshold_alerts.
+    In digest mode (INVENTORY_ALERT_DIGEST) every owner gets one summary email per page/run.
+    """
+    digest = settings.INVENTORY_ALERT_DIGEST if digest is None else digest
+
+    # 1. New Inventory Added
+    def new_inventory_page(page):
+        alerts = []
+        for inventory in page:
+            product_name = inventory['product__name']
+            alerts.append(Alert(
+                inventory['company_owner_id'],
+                "New inventory added",
+                f"New Inventory Added: {product_name}",
+                f"New batch {inventory['batch__batch_number']} of product {product_name} has been added to {inventory['warehouse__name']}.",
+            ))
+        _send_page_alerts(alerts, digest, "New Inventory")
+
+    new_inventory = Inventory.objects.values(
+        'id', 'txid', 'company_owner_id', 'product__name', 'batch__batch_number', 'warehouse__name'
+    )
+    new_count = consume_changes(
+        "inventory_management_notifications.new_inventory", new_inventory, new_inventory_page,
+    )
+
+    # 2. Inventory Transfer Alert
+    # Transfers write a transfer_out log on the source row that points at the destination warehouse
+    def transfer_page(page):
+        alerts = []
+        for log in page:
+            product_name = log['inventory__product__name']
+            alerts.append(Alert(
+                log['inventory__company_owner_id'],
+                "Transfers",
+                f"Inventory Transfer Alert: {product_name}",
+                f"{abs(log['change_quantity'])} units of {product_name} have been transferred from "
+                f"{log['inventory__warehouse__name']} to {log['counterpart_warehouse__name']}.",
+            ))
+        _send_page_alerts(alerts, digest, "Inventory Transfers")
+
+    transfer_logs = InventoryLog.objects.filter(log_type="transfer_out").values(
+        'id', 'txid', 'inventory__company_owner_id', 'inventory__product__name', 'inventory__warehouse__name',
+        'counterpart_warehouse__name', 'change_quantity'
+    )
+    transfer_count = consume_changes(
+        "inventory_management_notifications.transfers", transfer_logs, transfer_page,
+    )
+
+    # 3. Inventory Log Change
+    # Notify for any manual changes logged in InventoryLog
+    def log_page(page):
+        alerts = []
+        for log in page:
+            product_name = log['inventory__product__name']
+            reason = log['reason'] or "No reason provided"
+            alerts.append(Alert(
+                log['inventory__company_owner_id'],
+                "Inventory changes",
+                f"Inventory Log Change: {product_name}",
+                f"{log['change_quantity']} units have been added/removed from {product_name} in "
+                f"{log['inventory__warehouse__name']}. Reason: {reason}",
+            ))
+        _send_page_alerts(alerts, digest, "Inventory Changes")
+
+    inventory_logs = InventoryLog.objects.exclude(log_type__in=("transfer_out", "transfer_in")).values(
+        'id', 'txid', 'inventory__company_owner_id', 'inventory__product__name', 'inventory__warehouse__name',
+        'change_quantity', 'reason'
+    )
+    log_count = consume_changes(
+        "inventory_management_notifications.inventory_logs", inventory_logs, log_page,
+    )
+
+    print(
+        "Inventory management notifications sent successfully "
+        f"({new_count} new inventory row(s), {transfer_count} transfer(s), {log_count} log change(s))."
+    )
@@ -0,0 +1,13 @@
+from sales.models import drain_due_email_tasks
+
+def process_due_emails(task=None):
+    """
+    Standalone function to process and send due email tasks.
+    Claims batches until nothing is due, so several workers can run it at the same time.
+    """
+    sent, failed = drain_due_email_tasks()
+
+    if sent or failed:
+        print(f"Processed {sent + failed} due email tasks ({sent} sent, {failed} failed).")
+    else:
+        print("No due email tasks to process.")
@@ -0,0 +1,64 @@
+from stock_track.models import StockThresholdEvent
+from stock_track.change_feed import consume_changes
+from email_tasks.digest import Alert, build_notifications
+from email_tasks.outbox import enqueue_notifications
+from django.conf import settings
+
+
+def stock_threshold_alerts(task=None, digest=None):
+    """
+    Drains the stock threshold event queue and sends the matching notifications:
+    - Low Stock Alert
+    - No Stock Notification
+    - Restock Notification
+
+    The events are written by the inventory mutation paths (sales, transfers, inventory and
+    admin edits) when a row crosses its product's threshold, so this can run every few seconds
+    and only reads new events. When a row crossed several times within one page, only its
+    latest level is notified. In digest mode every owner gets one summary email per page.
+    """
+    digest = settings.INVENTORY_ALERT_DIGEST if digest is None else digest
+
+    def event_page(page):
+        latest = {}
+        for event in page:
+            latest[event['inventory_id']] = event
+
+        alerts = []
+        for event in latest.values():
+            product_name = event['inventory__product__name']
+            warehouse_name = event['inventory__warehouse__name']
+            if event['level'] == "out_of_stock":
+                alerts.append(Alert(
+                    event['company_owner_id'],
+                    "Out of stock",
+                    f"No Stock Notification: {product_name}",
+                    f"The stock for {product_name} in Warehouse {warehouse_name} is completely out.",
+                ))
+            elif event['level'] == "low_stock":
+                alerts.append(Alert(
+                    event['company_owner_id'],
+                    "Low stock",
+                    f"Low Stock Alert: {product_name}",
+                    f"The stock for {product_name} in Warehouse {warehouse_name} has fallen below the threshold of {event['threshold']}.",
+                ))
+            else:
+                alerts.append(Alert(
+                    event['company_owner_id'],
+                    "Restocked",
+                    f"Restock Notification: {product_name}",
+                    f"The stock for {product_name} in Warehouse {warehouse_name} is back above the threshold "
+                    f"of {event['threshold']} ({event['quantity']} units).",
+                ))
+
+        enqueue_notifications(build_notifications(alerts, digest, "Stock Alerts"))
+
+    events = StockThresholdEvent.objects.values(
+        'id', 'txid', 'company_owner_id', 'inventory_id', 'level', 'quantity', 'threshold',
+        'inventory__product__name', 'inventory__warehouse__name',
+    )
+    event_count = consume_changes(
+        "stock_threshold_alerts", events, event_page, from_start=True,
+    )
+
+    print(f"Stock threshold alerts sent successfully ({event_count} event(s)).")
@@ -0,0 +1,44 @@
+from stock_track.models import Inventory
+from email_tasks.digest import Alert, build_notifications
+from email_tasks.outbox import enqueue_notifications
+from django.conf import settings
+from django.db.models import F
+
+
+
+def supplier_batch_delivery_reminder(task=None, digest=None):
+    """
+    Notify the company_owner when a batch's stock level falls below the product's stock_alert_threshold,
+    prompting them to contact the supplier for replenishment.
+    In digest mode every owner gets one email listing all of the batches to reorder.
+    """
+    digest = settings.INVENTORY_ALERT_DIGEST if digest is None else digest
+    alerts = []
+    # Find batches with stock levels below the product's stock_alert_threshold
+    # (only batches with a supplier to contact)
+    low_stock_batches = (
+        Inventory.objects.filter(
+            quantity__lte=F('product__stock_alert_threshold'),
+            batch__supplier__isnull=False,
+        )
+        .values(
+            'company_owner_id', 'product__name', 'product__stock_alert_threshold', 'batch__batch_number',
+            'batch__supplier__name', 'batch__supplier__email', 'batch__supplier__contact_details',
+        )
+    )
+
+    for inventory in low_stock_batches:
+        product_name = inventory['product__name']
+        alerts.append(Alert(
+            inventory['company_owner_id'],
+            "Batches to reorder",
+            f"Supplier Batch Delivery Reminder: {product_name}",
+            f"The stock level for {product_name} (Batch {inventory['batch__batch_number']}) has fallen below "
+            f"the alert threshold of {inventory['product__stock_alert_threshold']}. "
+            f"Please contact {inventory['batch__supplier__name']} for replenishment "
+            f"(Email: {inventory['batch__supplier__email']}, Phone: {inventory['batch__supplier__contact_details']}).",
+        ))
+
+    enqueue_notifications(build_notifications(alerts, digest, "Supplier Batch Delivery Reminders"))
+
+    print("Supplier batch delivery reminders sent successfully.")
@@ -0,0 +1,93 @@
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.utils.timezone import now, timedelta
+from django.db.models import Sum, F
+from stock_track.models import Warehouse, Inventory, StockLevel
+from email_tasks.outbox import enqueue_notifications
+
+def warehouse_stock_overview(task=None):
+    """
+    Sends every company owner a single weekly summary of their own warehouses, including:
+    - Total inventory per warehouse
+    - Low-stock items per warehouse
+    - Expiring batches per warehouse
+
+    The whole run is a fixed number of grouped queries (warehouse totals and low-stock items
+    from the StockLevel table, expiring batches and the owners), however many tenants and
+    warehouses there are.
+    """
+    # Get today's date and calculate one week from now for expiring batches
+    today = now().date()
+    one_week_from_now = today + timedelta(days=7)
+
+    # 1. Total inventory per warehouse, for all owners at once (from the stock level table)
+    warehouses = (
+        Warehouse.objects.annotate(total_quantity=Sum('stock_levels__quantity'))
+        .values('id', 'name', 'company_owner_id', 'total_quantity')
+        .order_by('company_owner_id', 'name', 'id')
+    )
+
+    # 2. Low-stock items (items below their stock_alert_threshold across batches), grouped by warehouse
+    low_stock_by_warehouse = defaultdict(list)
+    low_stock_items = (
+        StockLevel.objects.filter(quantity__lte=F('product__stock_alert_threshold'))
+        .values('warehouse_id', 'product__name', 'product_variation__name', 'quantity', 'product__stock_alert_threshold')
+        .order_by('warehouse_id', 'product__name', 'product_variation__name')
+    )
+    for item in low_stock_items:
+        variation = f" - {item['product_variation__name']}" if item['product_variation__name'] else ""
+        low_stock_by_warehouse[item['warehouse_id']].append(
+            f"{item['product__name']}{variation} (Current: {item['quantity']}, "
+            f"Threshold: {item['product__stock_alert_threshold']})"
+        )
+
+    # 3. Expiring batches (batches expiring within the next 7 days), grouped by warehouse
+    expiring_by_warehouse = defaultdict(list)
+    expiring_batches = (
+        Inventory.objects.filter(
+            batch__expiry_date__gte=today,
+            batch__expiry_date__lte=one_week_from_now,
+        )
+        .values('warehouse_id', 'batch__batch_number', 'product__name', 'batch__expiry_date')
+        .order_by('warehouse_id', 'batch__expiry_date', 'batch__batch_number', 'product__name')
+        .distinct()
+    )
+    for batch in expiring_batches:
+        expiring_by_warehouse[batch['warehouse_id']].append(
+            f"{batch['batch__batch_number']} of {batch['product__name']} (Expires: {batch['batch__expiry_date']})"
+        )
+
+    # Compile the warehouse summaries of every owner
+    summaries_by_owner = defaultdict(list)
+    for warehouse in warehouses:
+        low_stock_summary = low_stock_by_warehouse[warehouse['id']]
+        expiring_batches_summary = expiring_by_warehouse[warehouse['id']]
+        summaries_by_owner[warehouse['company_owner_id']].append(
+            f"Warehouse: {warehouse['name']}\n"
+            f"1. Total Inventory: {warehouse['total_quantity'] or 0} units\n"
+            f"2. Low-Stock Items:\n"
+            + ("\n".join(low_stock_summary) if low_stock_summary else "No low-stock items") + "\n"
+            f"3. Expiring Batches:\n"
+            + ("\n".join(expiring_batches_summary) if expiring_batches_summary else "No expiring batches") + "\n\n"
+        )
+
+    # Prepare one email per owner, covering only that owner's warehouses
+    owners = get_user_model().objects.only('id', 'username', 'email').in_bulk(list(summaries_by_owner))
+    email_subject = "Weekly Stock Overview for All Warehouses"
+    notifications = [
+        (
+            owners[owner_id],
+            email_subject,
+            f"Dear {owners[owner_id].username},\n\n"
+            f"Weekly Summary for All Warehouses:\n\n"
+            + "\n".join(warehouse_summaries) +
+            "Thank you.",
+        )
+        for owner_id, warehouse_summaries in summaries_by_owner.items()
+    ]
+
+    # Send the email notifications
+    enqueue_notifications(notifications)
+
+    print(f"Warehouse stock overview sent to {len(notifications)} owner(s).")
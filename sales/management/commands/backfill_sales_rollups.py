@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+
+from profiles.models import CustomUser
+from sales.services import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild the daily sales rollup tables for a date range."
+
+    def add_arguments(self, parser):
+        parser.add_argument("start", help="First day to rebuild (YYYY-MM-DD).")
+        parser.add_argument("end", help="Last day to rebuild (YYYY-MM-DD).")
+        parser.add_argument("--owner", type=int, help="Only rebuild this company owner's rollups.")
+
+    def handle(self, *args, **options):
+        start, end = parse_date(options['start']), parse_date(options['end'])
+        if not start or not end or start > end:
+            raise CommandError("start and end must be valid dates with start <= end.")
+
+        # Owners with sales in the range, or with stale rollups for sales deleted since
+        owners = CustomUser.objects.filter(
+            Q(sales__sale_time__date__range=(start, end)) | Q(daily_client_sales__day__range=(start, end))
+        )
+        if options['owner']:
+            owners = owners.filter(id=options['owner'])
+
+        owner_ids = list(owners.values_list('id', flat=True).distinct())
+        for owner_id in owner_ids:
+            rebuild_sales_rollups(owner_id, start, end)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt sales rollups from {start} to {end} for {len(owner_ids)} owner(s)."
+        ))
@@ -0,0 +1,84 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import DecimalField, Max, Min, Sum, Value
+from django.db.models.functions import Coalesce
+
+from profiles.models import Client
+
+
+def reconcile_chunk(start_id, end_id, fix=True):
+    """
+    Recomputes total_spent for clients with start_id <= id < end_id from their sales.
+    The clients are locked while they are checked so concurrent sale deltas aren't overwritten.
+    Returns a list of (client_id, stored, actual) for every client that had drifted.
+    """
+    try:
+        with transaction.atomic():
+            stored = dict(
+                Client.objects.select_for_update()
+                .filter(id__gte=start_id, id__lt=end_id)
+                .values_list('id', 'total_spent')
+            )
+            actual = dict(
+                Client.objects.filter(id__in=stored)
+                .annotate(actual=Coalesce(
+                    Sum('sales__total_price'), Value(0),
+                    output_field=DecimalField(max_digits=10, decimal_places=2),
+                ))
+                .values_list('id', 'actual')
+            )
+
+            drifted = [
+                (client_id, stored[client_id], actual[client_id])
+                for client_id in stored
+                if stored[client_id] != actual[client_id]
+            ]
+            if fix and drifted:
+                Client.objects.bulk_update(
+                    [Client(id=client_id, total_spent=total) for client_id, _, total in drifted],
+                    ['total_spent'],
+                )
+        return drifted
+    finally:
+        # Each worker thread opens its own connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Recompute Client.total_spent from the sales table in parallel chunks and report any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Client ids per chunk.")
+        parser.add_argument("--workers", type=int, default=4, help="Chunks processed in parallel.")
+        parser.add_argument("--dry-run", action="store_true", help="Report drift without fixing it.")
+
+    def handle(self, *args, **options):
+        bounds = Client.objects.aggregate(low=Min('id'), high=Max('id'))
+        if bounds['low'] is None:
+            self.stdout.write("No clients to reconcile.")
+            return
+
+        chunk_size = options['chunk_size']
+        ranges = [
+            (start, start + chunk_size)
+            for start in range(bounds['low'], bounds['high'] + 1, chunk_size)
+        ]
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            results = pool.map(lambda chunk: reconcile_chunk(*chunk, fix=not options['dry_run']), ranges)
+            drifted = [row for chunk in results for row in chunk]
+
+        total_drift = sum((abs(actual - stored) for _, stored, actual in drifted), Decimal("0"))
+        for client_id, stored, actual in drifted[:50]:
+            self.stdout.write(f"Client {client_id}: stored {stored}, actual {actual}")
+        if len(drifted) > 50:
+            self.stdout.write(f"... and {len(drifted) - 50} more")
+
+        action = "Found" if options['dry_run'] else "Fixed"
+        self.stdout.write(self.style.SUCCESS(
+            f"{action} {len(drifted)} drifted client total(s) across {len(ranges)} chunk(s); "
+            f"absolute drift {total_drift}."
+        ))
@@ -0,0 +1,93 @@
+import heapq
+import select
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from sales.models import EMAIL_TASK_CHANNEL, EmailTask, drain_due_email_tasks
+
+
+class Command(BaseCommand):
+    help = (
+        "Long-running EmailTask scheduler: sleeps until the next task is due and is woken early "
+        "through Postgres LISTEN/NOTIFY when new tasks are created."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--resync", type=int,
+            help="Seconds between full resyncs with the database (default: EMAIL_SCHEDULER_RESYNC_SECONDS).",
+        )
+
+    def handle(self, *args, **options):
+        resync = options['resync'] or settings.EMAIL_SCHEDULER_RESYNC_SECONDS
+
+        connection.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {EMAIL_TASK_CHANNEL}")
+        listener = connection.connection
+
+        self.stdout.write(f"Email scheduler listening on '{EMAIL_TASK_CHANNEL}'.")
+        due_times = self.load_due_times()
+        next_resync = time.monotonic() + resync
+        try:
+            while True:
+                now_time = timezone.now()
+                if due_times and due_times[0] <= now_time:
+                    sent, failed = drain_due_email_tasks()
+                    if sent or failed:
+                        self.stdout.write(f"Processed {sent + failed} due email tasks ({sent} sent, {failed} failed).")
+                    # Due times still in the past belong to tasks another worker holds; don't spin on them
+                    due_times = [due for due in self.load_due_times() if due > now_time]
+                    heapq.heapify(due_times)
+                    continue
+
+                if time.monotonic() >= next_resync:
+                    # Catches tasks created without a notification and retries rescheduled by other workers
+                    due_times = self.load_due_times()
+                    next_resync = time.monotonic() + resync
+                    continue
+
+                timeout = next_resync - time.monotonic()
+                if due_times:
+                    timeout = min(timeout, (due_times[0] - now_time).total_seconds())
+
+                # Idle: no queries at all until a task is due or a notification arrives. Notifications
+                # that came in during the queries above are already read off the socket, so they're
+                # handled first instead of waiting for the socket to become readable
+                if not listener.notifies:
+                    readable, _, _ = select.select([listener], [], [], max(timeout, 0))
+                    if readable:
+                        listener.poll()
+                while listener.notifies:
+                    due = parse_datetime(listener.notifies.pop(0).payload)
+                    if due:
+                        heapq.heappush(due_times, due)
+        except KeyboardInterrupt:
+            self.stdout.write("Email scheduler stopped.")
+
+    def load_due_times(self):
+        """
+        Returns a min-heap of the next due times: the earliest pending tasks (read from the partial
+        index on pending tasks) and the moment the oldest claim goes stale and can be taken over.
+        """
+        due_times = list(
+            EmailTask.objects.filter(status="pending")
+            .order_by('time_to_send')
+            .values_list('time_to_send', flat=True)[:settings.EMAIL_SCHEDULER_HEAP_SIZE]
+        )
+        oldest_claim = (
+            EmailTask.objects.filter(status="claimed")
+            .order_by('claimed_at')
+            .values_list('claimed_at', flat=True)
+            .first()
+        )
+        if oldest_claim:
+            due_times.append(oldest_claim + timedelta(seconds=settings.EMAIL_TASK_CLAIM_TIMEOUT))
+        heapq.heapify(due_times)
+        return due_times
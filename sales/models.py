@@ -1,14 +1,16 @@
-from django.db import models
+from django.db import connection, models, transaction
 
 from django.conf import settings
-from django.db.models import Sum
+from django.db.models import F, Q
 from stock_track.models import Product, ProductVariation, Inventory, InventoryLog, Batch
 from profiles.models import Client
 from django.utils import timezone
 
-from concurrent.futures import ThreadPoolExecutor
-from django.core.mail import send_mail
-import random
+from collections import defaultdict
+from datetime import timedelta
+from django.core.mail import EmailMessage
+from email_tasks.mail import send_messages_pooled
+from email_tasks.ratelimit import take_send_tokens
 
 '''
 I'll ask the free trial users owner about
@@ -59,19 +61,25 @@ class Sale(models.Model):
         verbose_name="Applied Coupon"
     )
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, editable=False, blank=True)
-    sale_time = models.DateTimeField(auto_now_add=True, verbose_name="Sale Date & Time")
+    idempotency_key = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name="Idempotency Key",
+        help_text="Set by offline POS terminals so a re-sent sale is only recorded once."
+    )
+    # Not auto_now_add, so offline sales can keep the time they were made at
+    sale_time = models.DateTimeField(default=timezone.now, editable=False, verbose_name="Sale Date & Time")
     last_updated = models.DateTimeField(auto_now=True, verbose_name="Last Updated")
 
     def update_total_price(self):
         """
         Updates the total price of the sale based on its related sale items and applied coupon.
+        The recalculation is deferred until the transaction commits and runs once per sale.
         """
-        total = self.items.aggregate(total=Sum('total_price'))['total'] or 0
-        if self.coupon and self.coupon.is_valid():
-            discount = (self.coupon.discount_percentage / 100) * total
-            total -= discount
-        self.total_price = total
-        self.save()
+        from .services import schedule_total_recompute
+        schedule_total_recompute(self.pk)
 
     def __str__(self):
         return f"Sale to {self.client.name} on {self.sale_time.strftime('%Y-%m-%d')}"
@@ -79,6 +87,9 @@ class Sale(models.Model):
     class Meta:
         verbose_name = "Sale"
         verbose_name_plural = "Sales"
+        constraints = [
+            models.UniqueConstraint(fields=['company_owner', 'idempotency_key'], name='unique_sale_idempotency_key')
+        ]
         
 
 class SaleItem(models.Model):
@@ -136,6 +147,109 @@ class SaleItem(models.Model):
         verbose_name_plural = "Sale Items"
 
 
+# Pre-aggregated sales per day, read by the D/W/M/Y reports instead of scanning Sale/SaleItem
+class DailyProductSales(models.Model):
+    company_owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="daily_product_sales",
+        verbose_name="Company Owner"
+    )
+    day = models.DateField(verbose_name="Day")
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name="daily_sales",
+        verbose_name="Product"
+    )
+    product_variation = models.ForeignKey(
+        ProductVariation,
+        on_delete=models.CASCADE,
+        related_name="daily_sales",
+        verbose_name="Product Variation",
+        null=True,
+        blank=True
+    )
+    quantity = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Quantity Sold")
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Revenue")
+
+    def __str__(self):
+        return f"{self.product} on {self.day} - Qty: {self.quantity}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['company_owner', 'day', 'product', 'product_variation'],
+                name='unique_daily_product_sales',
+                nulls_distinct=False,
+            )
+        ]
+        verbose_name = "Daily Product Sales"
+        verbose_name_plural = "Daily Product Sales"
+
+
+class DailyClientSales(models.Model):
+    company_owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="daily_client_sales",
+        verbose_name="Company Owner"
+    )
+    day = models.DateField(verbose_name="Day")
+    client = models.ForeignKey(
+        Client,
+        on_delete=models.CASCADE,
+        related_name="daily_sales",
+        verbose_name="Client"
+    )
+    sale_count = models.PositiveIntegerField(default=0, verbose_name="Number of Sales")
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0, verbose_name="Revenue")
+
+    def __str__(self):
+        return f"{self.client} on {self.day} - {self.revenue}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company_owner', 'day', 'client'], name='unique_daily_client_sales')
+        ]
+        verbose_name = "Daily Client Sales"
+        verbose_name_plural = "Daily Client Sales"
+
+
+# Item-to-item co-purchase index, rebuilt offline by sales.recommendations.build_recommendation_index
+class ProductRecommendation(models.Model):
+    company_owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="product_recommendations",
+        verbose_name="Company Owner"
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name="recommendations",
+        verbose_name="Product"
+    )
+    recommended_product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name="recommended_with",
+        verbose_name="Recommended Product"
+    )
+    score = models.FloatField(verbose_name="Similarity Score")
+
+    def __str__(self):
+        return f"{self.product} -> {self.recommended_product} ({self.score:.3f})"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'recommended_product'], name='unique_product_recommendation')
+        ]
+        indexes = [
+            models.Index(fields=['product', '-score'], name='product_recommendation_score'),
+        ]
+
+
 # EmailTask model logs tasks with metadata to manage and send emails.
 class EmailTask(models.Model):
     EMAIL_TYPES = [
@@ -154,49 +268,89 @@ class EmailTask(models.Model):
         choices=EMAIL_TYPES,
         verbose_name="Email Type"
     )
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("claimed", "Claimed"),
+        ("sent", "Sent"),
+        ("failed", "Failed"),
+    ]
     time_to_send = models.DateTimeField(verbose_name="Time to Send")
-    sent = models.BooleanField(default=False, verbose_name="Sent")
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default="pending",
+        verbose_name="Status"
+    )
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Attempts")
+    claimed_at = models.DateTimeField(null=True, blank=True, verbose_name="Claimed At")
+    last_error = models.TextField(blank=True, null=True, verbose_name="Last Error")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Created At")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Updated At")
 
     def __str__(self):
-        return f"{self.email_type} for Sale ID {self.sale.id} at {self.time_to_send}"
+        return f"{self.email_type} for Sale ID {self.sale_id} at {self.time_to_send} ({self.status})"
 
     class Meta:
         ordering = ['time_to_send']
+        indexes = [
+            # Only unsent tasks are indexed, so finding the next due time stays cheap however many were sent
+            models.Index(fields=['time_to_send'], name='email_task_pending_due', condition=Q(status="pending")),
+            models.Index(fields=['claimed_at'], name='email_task_claimed', condition=Q(status="claimed")),
+        ]
 
 
+# Postgres channel the email scheduler (run_email_scheduler) listens on
+EMAIL_TASK_CHANNEL = "email_tasks"
 
 
-def generate_product_recommendations(sale):
+def notify_email_scheduler(email_tasks):
     """
-    Generate product recommendations based on the categories of purchased products.
+    Wakes the email scheduler with the earliest due time of newly created EmailTasks.
+    NOTIFY is only delivered when the surrounding transaction commits, and not at all on rollback.
     """
-    # Get all purchased products from the sale
-    purchased_products = sale.items.all().values_list('product', flat=True)
+    due_times = [email_task.time_to_send for email_task in email_tasks]
+    if due_times:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [EMAIL_TASK_CHANNEL, min(due_times).isoformat()])
+
 
-    # Fetch the categories of the purchased products
-    categories = Product.objects.filter(id__in=purchased_products).values_list('category', flat=True).distinct()
 
-    # Initialize recommendations
-    recommendations = []
 
-    for category_id in categories:
-        # Get all products in the category, excluding the purchased products
-        category_products = Product.objects.filter(category_id=category_id).exclude(id__in=purchased_products)
+def generate_product_recommendations(sale, limit=5):
+    """
+    Generate product recommendations from the precomputed co-purchase index:
+    the products most often bought together with the ones in this sale.
+    """
+    purchased_products = sale.items.values('product_id')
+
+    # One query: neighbours of every purchased product, best first
+    neighbours = (
+        ProductRecommendation.objects.filter(
+            product_id__in=purchased_products,
+            recommended_product__is_active=True,
+        )
+        .exclude(recommended_product_id__in=purchased_products)
+        .order_by('-score')
+        .values_list('recommended_product_id', 'recommended_product__name')[:limit * 10]
+    )
 
-        # Randomly sample up to 5 products from the category
-        sampled_products = random.sample(list(category_products), min(len(category_products), 5))
-        recommendations.extend(sampled_products)
+    recommendations = {}
+    for product_id, name in neighbours:
+        recommendations.setdefault(product_id, name)
+        if len(recommendations) == limit:
+            break
 
     # Format the recommendations into a string
-    recommendation_list = "\n".join([product.name for product in recommendations])
+    recommendation_list = "\n".join(recommendations.values())
 
     # Return the recommendations or a default message
     return recommendation_list or "No recommendations available at this time."
 
-# Function for directly sending in the email campaings after the sail to the company's client
-def send_email_task(email_task):
+def build_email_task_message(email_task):
+    """
+    Builds the EmailMessage of a thank you / feedback / recommendation task,
+    sent from the company owner's own address.
+    """
     sale = email_task.sale
     company_owner = sale.company_owner
     recipient_email = sale.client.email  # Assuming the Client model has an email field.
@@ -216,25 +370,149 @@ def send_email_task(email_task):
         email_subject = "We Have Some Recommendations for You!"
         email_body = f"Dear {sale.client.name},\n\nBased on your previous purchases, you might like:\n{recommendations}\n\nBest Regards,\n{company_owner.company_name}"
 
-    # Send email
-    try:
-        send_mail(
-            subject=email_subject,
-            message=email_body,
-            from_email=company_owner.email,  # Sender's email
-            recipient_list=[recipient_email],
-            auth_user=company_owner.email,
-            auth_password=company_owner.email_password,
-            fail_silently=False,
-        )
-        email_task.sent = True  # Mark task as sent
-        email_task.save()
-    except Exception as e:
-        print(f"Error sending email for task {email_task.id}: {e}")
+    return EmailMessage(
+        subject=email_subject,
+        body=email_body,
+        from_email=company_owner.email,  # Sender's email
+        to=[recipient_email],
+    )
+
 
+# Function for directly sending in the email campaings after the sail to the company's client
+def send_email_task(email_task):
+    sent, _ = send_email_tasks([email_task])
+    return sent == 1
 
-executor = ThreadPoolExecutor(max_workers=5)
 
-def execute_email_tasks(email_tasks):
+def send_email_tasks(email_tasks):
+    """
+    Sends claimed EmailTasks grouped by company owner: each owner's messages go out logged in
+    with that owner's credentials, over one SMTP session (EMAIL_DELIVERY_ENGINE "pooled") or
+    a pool of concurrent sessions per owner ("async"). Tasks beyond the owner's send rate
+    budget are put back, without counting an attempt, for when the budget allows them.
+    Returns (sent, deferred): the number of sent tasks and of tasks put back for the rate limit.
+    """
+    by_owner = defaultdict(list)
     for email_task in email_tasks:
-        executor.submit(send_email_task, email_task)
+        try:
+            message = build_email_task_message(email_task)
+        except Exception as e:
+            mark_email_task_failed(email_task, e)
+            continue
+        by_owner[email_task.sale.company_owner_id].append((email_task, message))
+
+    # Only send what each owner's rate budget allows now; the rest is rescheduled into the budget
+    sendable = []
+    batches = []
+    deferred = []
+    for owner_messages in by_owner.values():
+        company_owner = owner_messages[0][0].sale.company_owner
+        granted, later = take_send_tokens(company_owner.email, len(owner_messages))
+        for (email_task, _), when in zip(owner_messages[granted:], later):
+            email_task.status = "pending"
+            email_task.time_to_send = when
+            deferred.append(email_task)
+        sendable.append(owner_messages[:granted])
+        batches.append((company_owner.email, company_owner.email_password, [message for _, message in owner_messages[:granted]]))
+    if deferred:
+        EmailTask.objects.bulk_update(deferred, ['status', 'time_to_send'])
+
+    if settings.EMAIL_DELIVERY_ENGINE == "async":
+        from email_tasks.async_mail import send_messages_async
+        results = send_messages_async(batches)
+    else:
+        results = [
+            send_messages_pooled(messages, username=username, password=password)
+            for username, password, messages in batches
+        ]
+
+    sent = 0
+    for owner_messages, owner_results in zip(sendable, results):
+        for (email_task, _), error in zip(owner_messages, owner_results):
+            if error is None:
+                mark_email_task_sent(email_task)
+                sent += 1
+            else:
+                mark_email_task_failed(email_task, error)
+    return sent, len(deferred)
+
+
+def claim_due_email_tasks(batch_size=None):
+    """
+    Claims a batch of due EmailTasks for the calling worker.
+
+    Rows are picked with SELECT ... FOR UPDATE SKIP LOCKED, so any number of worker processes can
+    drain the queue in parallel without ever claiming (and sending) the same task twice. Claims
+    left behind by a crashed worker become claimable again after EMAIL_TASK_CLAIM_TIMEOUT.
+    """
+    batch_size = batch_size or settings.EMAIL_TASK_BATCH_SIZE
+    now_time = timezone.now()
+    stale_claim = now_time - timedelta(seconds=settings.EMAIL_TASK_CLAIM_TIMEOUT)
+
+    with transaction.atomic():
+        email_tasks = list(
+            EmailTask.objects.select_for_update(skip_locked=True, of=('self',))
+            .select_related('sale__client', 'sale__company_owner')
+            .filter(
+                Q(status="pending", time_to_send__lte=now_time)
+                | Q(status="claimed", claimed_at__lt=stale_claim)
+            )
+            .order_by('time_to_send')[:batch_size]
+        )
+        EmailTask.objects.filter(pk__in=[email_task.pk for email_task in email_tasks]).update(
+            status="claimed", claimed_at=now_time, updated_at=now_time
+        )
+
+    for email_task in email_tasks:
+        email_task.status = "claimed"
+        email_task.claimed_at = now_time
+    return email_tasks
+
+
+def drain_due_email_tasks():
+    """
+    Claims and sends batches until nothing is due, so several workers can run it at the same time.
+    Returns (sent, failed).
+    """
+    sent = failed = 0
+    while True:
+        email_tasks = claim_due_email_tasks()
+        if not email_tasks:
+            break
+        batch_sent, batch_deferred = send_email_tasks(email_tasks)
+        sent += batch_sent
+        # Tasks deferred by the rate limit are back in the queue, not failed
+        failed += len(email_tasks) - batch_sent - batch_deferred
+    return sent, failed
+
+
+def mark_email_task_sent(email_task):
+    email_task.status = "sent"
+    email_task.attempts += 1
+    EmailTask.objects.filter(pk=email_task.pk, status="claimed").update(
+        status="sent", attempts=F('attempts') + 1, last_error=None, updated_at=timezone.now()
+    )
+
+
+def mark_email_task_failed(email_task, error):
+    """
+    Puts a failed task back in the queue with exponential backoff, or marks it as failed
+    for good once it has used up EMAIL_TASK_MAX_ATTEMPTS.
+    """
+    now_time = timezone.now()
+    email_task.attempts += 1
+    email_task.last_error = str(error)
+    if email_task.attempts >= settings.EMAIL_TASK_MAX_ATTEMPTS:
+        email_task.status = "failed"
+    else:
+        email_task.status = "pending"
+        backoff = settings.EMAIL_TASK_RETRY_BACKOFF * 2 ** (email_task.attempts - 1)
+        email_task.time_to_send = now_time + timedelta(seconds=backoff)
+
+    EmailTask.objects.filter(pk=email_task.pk, status="claimed").update(
+        status=email_task.status,
+        attempts=email_task.attempts,
+        last_error=email_task.last_error,
+        time_to_send=email_task.time_to_send,
+        updated_at=now_time,
+    )
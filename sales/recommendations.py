@@ -0,0 +1,70 @@
+import numpy as np
+from scipy import sparse
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ProductRecommendation, SaleItem
+
+
+def build_recommendation_index(company_owner_id, top_k=None):
+    """
+    Rebuilds one tenant's item-to-item recommendation index from its SaleItem history.
+
+    Sales are turned into a binary sale x product sparse matrix X; X.T @ X counts how often
+    every pair of products was bought together, which is normalised to a cosine similarity.
+    The `top_k` most similar products of each product are stored in ProductRecommendation.
+    Returns the number of rows written.
+    """
+    top_k = top_k or settings.RECOMMENDATION_TOP_K
+
+    pairs = np.array(
+        list(
+            SaleItem.objects.filter(sale__company_owner_id=company_owner_id)
+            .values_list('sale_id', 'product_id')
+            .distinct()
+        ),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+
+    rows = []
+    if len(pairs):
+        _, sale_index = np.unique(pairs[:, 0], return_inverse=True)
+        product_ids, product_index = np.unique(pairs[:, 1], return_inverse=True)
+
+        purchases = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.float32), (sale_index, product_index)),
+            shape=(sale_index.max() + 1, len(product_ids)),
+        )
+
+        # Co-purchase counts, without a product's similarity to itself
+        co_purchases = (purchases.T @ purchases).tocsr()
+        co_purchases.setdiag(0)
+        co_purchases.eliminate_zeros()
+
+        # Cosine similarity: count(i, j) / sqrt(count(i) * count(j))
+        norms = sparse.diags(1 / np.sqrt(np.asarray(purchases.sum(axis=0)).ravel()))
+        similarity = (norms @ co_purchases @ norms).tocsr()
+
+        for index, product_id in enumerate(product_ids):
+            start, end = similarity.indptr[index], similarity.indptr[index + 1]
+            if start == end:
+                continue
+            scores = similarity.data[start:end]
+            neighbours = similarity.indices[start:end]
+            best = np.argsort(-scores)[:top_k]
+            rows.extend(
+                ProductRecommendation(
+                    company_owner_id=company_owner_id,
+                    product_id=int(product_id),
+                    recommended_product_id=int(product_ids[neighbours[position]]),
+                    score=float(scores[position]),
+                )
+                for position in best
+            )
+
+    with transaction.atomic():
+        ProductRecommendation.objects.filter(company_owner_id=company_owner_id).delete()
+        ProductRecommendation.objects.bulk_create(rows, batch_size=1000)
+
+    return len(rows)
@@ -0,0 +1,644 @@
+import weakref
+from collections import defaultdict
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, DecimalField, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from profiles.models import Client
+from stock_track.models import Product, ProductVariation
+from stock_track.services import InsufficientStockError, StockDemand, allocate_stock
+from stock_track.stock_levels import available_quantities
+from .models import (
+    Coupon, DailyClientSales, DailyProductSales, EmailTask, Sale, SaleItem, notify_email_scheduler,
+)
+
+
+class CheckoutError(ValueError):
+    """
+    Raised when a cart can't be turned into a sale. `errors` holds one message per problem.
+    """
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(errors))
+
+
+############################### Deferred total recomputation
+
+class _PendingTotals:
+    """
+    Sales whose totals have to be recomputed once the current transaction commits.
+    """
+
+    def __init__(self):
+        self.sale_ids = set()
+
+    def __call__(self):
+        transaction.get_connection().pending_totals = None
+        recompute_totals(sale_ids=self.sale_ids)
+
+
+def _pending_totals():
+    """
+    Returns the pending set of the current transaction, registering a new one with on_commit the
+    first time. Returns None outside of a transaction (autocommit).
+
+    The connection only keeps a weak reference to it: the set is cleared when it runs on commit,
+    and on rollback Django drops the on_commit callback, the only strong reference, with it.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return None
+
+    pending_ref = getattr(connection, 'pending_totals', None)
+    pending = pending_ref() if pending_ref else None
+    if pending is None:
+        pending = _PendingTotals()
+        transaction.on_commit(pending)
+        connection.pending_totals = weakref.ref(pending)
+    return pending
+
+
+def schedule_total_recompute(sale_id):
+    """
+    Marks a sale as dirty. Each dirty sale is recalculated exactly once when the transaction
+    commits, however many of its lines were touched.
+    """
+    pending = _pending_totals()
+    if pending is None:
+        recompute_totals(sale_ids={sale_id})
+        return
+
+    pending.sale_ids.add(sale_id)
+
+
+def apply_client_deltas(deltas):
+    """
+    Adds {client_id: delta} to Client.total_spent with a single UPDATE, using
+    F('total_spent') + delta so concurrent writers never overwrite each other.
+    """
+    deltas = {client_id: delta for client_id, delta in deltas.items() if client_id and delta}
+    if not deltas:
+        return
+
+    Client.objects.filter(pk__in=deltas).update(
+        total_spent=F('total_spent') + Case(
+            *[When(pk=client_id, then=Value(delta)) for client_id, delta in deltas.items()],
+            default=Value(0),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        )
+    )
+
+
+def recompute_totals(sale_ids=()):
+    """
+    Recalculates Sale.total_price for the given ids with one aggregate query and one bulk update,
+    then moves each client's total_spent and daily revenue by the difference between the old
+    and new totals. Bulk updates don't fire post_save, so this never recurses.
+    """
+    if not sale_ids:
+        return
+
+    with transaction.atomic():
+        # Lock the sales so two concurrent recomputes can't both apply the same delta
+        sales = list(
+            Sale.objects.select_for_update(of=('self',))
+            .select_related('coupon')
+            .filter(pk__in=sale_ids)
+        )
+        item_totals = dict(
+            SaleItem.objects.filter(sale_id__in=[sale.pk for sale in sales])
+            .values('sale_id')
+            .annotate(total=Sum('total_price'))
+            .values_list('sale_id', 'total')
+        )
+
+        changed = []
+        deltas = defaultdict(Decimal)
+        client_rollups = RollupDeltas()
+        for sale in sales:
+            total = item_totals.get(sale.pk) or 0
+            if sale.coupon and sale.coupon.is_valid():
+                discount = (sale.coupon.discount_percentage / 100) * total
+                total -= discount
+            total = Decimal(total).quantize(Decimal("0.01"), ROUND_HALF_UP)
+            if total != sale.total_price:
+                deltas[sale.client_id] += total - sale.total_price
+                client_rollups.add(client_rollup_key(sale), 0, total - sale.total_price)
+                sale.total_price = total
+                changed.append(sale)
+
+        if changed:
+            Sale.objects.bulk_update(changed, ['total_price'])
+        apply_client_deltas(deltas)
+        apply_rollup_deltas(client_deltas=client_rollups)
+
+
+############################### Sales rollups
+
+class RollupDeltas(defaultdict):
+    """
+    {rollup key: [count or quantity, revenue]} changes to add to one of the rollup tables.
+    """
+
+    def __init__(self):
+        super().__init__(lambda: [0, Decimal("0")])
+
+    def add(self, key, amount, revenue):
+        self[key][0] += amount
+        self[key][1] += revenue
+
+
+def _sale_day(sale):
+    return sale.company_owner_id, timezone.localdate(sale.sale_time)
+
+
+def client_rollup_key(sale, client_id=None):
+    return (*_sale_day(sale), client_id or sale.client_id)
+
+
+def product_rollup_key(sale, product_id, product_variation_id):
+    return (*_sale_day(sale), product_id, product_variation_id)
+
+
+def sale_rollup_deltas(sales, items):
+    """
+    Rollup deltas of newly written sales and their items: (product deltas, client deltas).
+    """
+    product_deltas = RollupDeltas()
+    for item in items:
+        product_deltas.add(
+            product_rollup_key(item.sale, item.product_id, item.product_variation_id),
+            item.quantity, item.total_price,
+        )
+    client_deltas = RollupDeltas()
+    for sale in sales:
+        client_deltas.add(client_rollup_key(sale), 1, sale.total_price)
+    return product_deltas, client_deltas
+
+
+def _upsert_rollup(cursor, model, key_columns, amount_column, deltas):
+    # A fixed order, so concurrent sales lock the rollup rows in the same order
+    rows = sorted(
+        ((key, values) for key, values in deltas.items() if values[0] or values[1]),
+        key=lambda item: tuple(-1 if part is None else part for part in item[0]),
+    )
+    if not rows:
+        return
+    table = model._meta.db_table
+    columns = [*key_columns, amount_column, 'revenue']
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    cursor.execute(
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES {', '.join([placeholders] * len(rows))} "
+        f"ON CONFLICT ({', '.join(key_columns)}) "
+        f"DO UPDATE SET {amount_column} = {table}.{amount_column} + EXCLUDED.{amount_column}, "
+        f"revenue = {table}.revenue + EXCLUDED.revenue",
+        [value for key, values in rows for value in (*key, *values)],
+    )
+
+
+def apply_rollup_deltas(product_deltas=None, client_deltas=None):
+    """
+    Adds per-sale changes to the daily rollups: product deltas keyed by
+    (owner_id, day, product_id, product_variation_id) and client deltas keyed by
+    (owner_id, day, client_id). Each table takes one INSERT ... ON CONFLICT DO UPDATE that adds
+    to the existing row, so concurrent sales of the same owner and day never collide. Call it
+    in the transaction of the change it mirrors.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        if product_deltas:
+            _upsert_rollup(
+                cursor, DailyProductSales,
+                ['company_owner_id', 'day', 'product_id', 'product_variation_id'], 'quantity', product_deltas,
+            )
+        if client_deltas:
+            _upsert_rollup(
+                cursor, DailyClientSales, ['company_owner_id', 'day', 'client_id'], 'sale_count', client_deltas,
+            )
+
+
+def _subtract_rollup(model, key_columns, amount_column, deltas):
+    for key, (amount, revenue) in sorted(
+        deltas.items(), key=lambda item: tuple(-1 if part is None else part for part in item[0])
+    ):
+        if amount or revenue:
+            model.objects.filter(**dict(zip(key_columns, key))).update(
+                **{amount_column: F(amount_column) - amount}, revenue=F('revenue') - revenue
+            )
+
+
+def remove_rollup_deltas(product_deltas=None, client_deltas=None):
+    """
+    Takes deleted sales and items off their existing rollup rows, keyed like
+    apply_rollup_deltas(). Unlike it, it never creates rows, since the client or product may be
+    on its way out in the same cascade and its rollup rows already deleted.
+    """
+    with transaction.atomic():
+        if product_deltas:
+            _subtract_rollup(
+                DailyProductSales, ['company_owner_id', 'day', 'product_id', 'product_variation_id'],
+                'quantity', product_deltas,
+            )
+        if client_deltas:
+            _subtract_rollup(
+                DailyClientSales, ['company_owner_id', 'day', 'client_id'], 'sale_count', client_deltas,
+            )
+
+
+def rebuild_sales_rollups(company_owner_id, start, end):
+    """
+    Rebuilds one owner's DailyProductSales and DailyClientSales rows for the inclusive
+    `start`..`end` date range from the sales themselves. Each table is refreshed with one delete,
+    one grouped aggregate and one bulk insert. Live sales keep the rollups current by deltas;
+    this is for backfills and repairs.
+    """
+    sales = Sale.objects.filter(company_owner_id=company_owner_id, sale_time__date__range=(start, end))
+
+    with transaction.atomic():
+        DailyProductSales.objects.filter(company_owner_id=company_owner_id, day__range=(start, end)).delete()
+        DailyClientSales.objects.filter(company_owner_id=company_owner_id, day__range=(start, end)).delete()
+
+        product_rows = (
+            SaleItem.objects.filter(sale__in=sales)
+            .annotate(day=TruncDate('sale__sale_time'))
+            .values('day', 'product_id', 'product_variation_id')
+            .annotate(quantity_sold=Sum('quantity'), revenue=Sum('total_price'))
+            .order_by()
+        )
+        DailyProductSales.objects.bulk_create([
+            DailyProductSales(
+                company_owner_id=company_owner_id,
+                day=row['day'],
+                product_id=row['product_id'],
+                product_variation_id=row['product_variation_id'],
+                quantity=row['quantity_sold'],
+                revenue=row['revenue'],
+            )
+            for row in product_rows
+        ], batch_size=1000)
+
+        client_rows = (
+            sales.annotate(day=TruncDate('sale_time'))
+            .values('day', 'client_id')
+            .annotate(sale_count=Count('id'), revenue=Sum('total_price'))
+            .order_by()
+        )
+        DailyClientSales.objects.bulk_create([
+            DailyClientSales(
+                company_owner_id=company_owner_id,
+                day=row['day'],
+                client_id=row['client_id'],
+                sale_count=row['sale_count'],
+                revenue=row['revenue'],
+            )
+            for row in client_rows
+        ], batch_size=1000)
+
+
+############################### Checkout
+
+def _parse_cart_lines(lines):
+    """
+    Validates raw cart lines and merges repeated (product, variation) pairs into one line.
+    Returns {(product_id, product_variation_id): quantity}.
+    """
+    if not isinstance(lines, list):
+        raise CheckoutError(["items must be a list."])
+
+    errors = []
+    cart = {}
+    for index, line in enumerate(lines, start=1):
+        if not isinstance(line, dict):
+            errors.append(f"Line {index}: must be an object.")
+            continue
+        try:
+            product_id = int(line["product_id"])
+            variation_id = line.get("product_variation_id")
+            variation_id = int(variation_id) if variation_id not in (None, "") else None
+            quantity = Decimal(str(line["quantity"]))
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            errors.append(f"Line {index}: product_id and a numeric quantity are required.")
+            continue
+        if quantity <= 0:
+            errors.append(f"Line {index}: quantity must be greater than zero.")
+            continue
+        key = (product_id, variation_id)
+        cart[key] = cart.get(key, 0) + quantity
+
+    if not cart and not errors:
+        errors.append("The cart is empty.")
+    if errors:
+        raise CheckoutError(errors)
+    return cart
+
+
+def _load_unit_prices(company_owner, keys):
+    """
+    Looks up the unit price of every (product_id, product_variation_id) key with one query for
+    products and one for variations. Keys that don't belong to the owner are left out.
+    """
+    products = dict(
+        Product.objects.filter(
+            company_owner=company_owner, pk__in={product_id for product_id, _ in keys}
+        ).values_list('id', 'price')
+    )
+    variations = {
+        variation_id: (product_id, price)
+        for variation_id, product_id, price in ProductVariation.objects.filter(
+            product__company_owner=company_owner,
+            pk__in={variation_id for _, variation_id in keys if variation_id},
+        ).values_list('id', 'product_id', 'price')
+    }
+
+    prices = {}
+    for product_id, variation_id in keys:
+        if product_id not in products:
+            continue
+        if variation_id is None:
+            prices[(product_id, variation_id)] = products[product_id]
+        elif variations.get(variation_id, (None,))[0] == product_id:
+            prices[(product_id, variation_id)] = variations[variation_id][1]
+    return prices
+
+
+def _check_prices(cart, prices):
+    errors = [
+        f"Product {product_id} does not exist."
+        if variation_id is None else
+        f"Variation {variation_id} does not exist for product {product_id}."
+        for product_id, variation_id in cart
+        if (product_id, variation_id) not in prices
+    ]
+    if errors:
+        raise CheckoutError(errors)
+
+
+def _check_stock(company_owner, cart):
+    """
+    Rejects lines that ask for more than can be sold (on hand, less expired batches), read
+    before any inventory row is locked. allocate_stock still has the final word.
+    """
+    available = available_quantities(company_owner, cart)
+    errors = [
+        f"Only {available[item]} units of product {item[0]} are in stock."
+        if item[1] is None else
+        f"Only {available[item]} units of variation {item[1]} of product {item[0]} are in stock."
+        for item, quantity in cart.items()
+        if available[item] < quantity
+    ]
+    if errors:
+        raise CheckoutError(errors)
+
+
+def _build_sale_items(sale, cart, prices):
+    items = []
+    for (product_id, variation_id), quantity in cart.items():
+        unit_price = prices[(product_id, variation_id)]
+        items.append(SaleItem(
+            sale=sale,
+            product_id=product_id,
+            product_variation_id=variation_id,
+            quantity=quantity,
+            unit_price=unit_price,
+            total_price=unit_price * quantity,
+        ))
+    return items
+
+
+def _sale_total(items, coupon):
+    total = sum((item.total_price for item in items), Decimal("0"))
+    if coupon and coupon.is_valid():
+        total -= (coupon.discount_percentage / 100) * total
+    return total.quantize(Decimal("0.01"), ROUND_HALF_UP)
+
+
+def _stock_demands(items, client):
+    return [
+        StockDemand(
+            product_id=item.product_id,
+            product_variation_id=item.product_variation_id,
+            quantity=item.quantity,
+            reason=f"Sale to client {client.name}",
+        )
+        for item in items
+    ]
+
+
+def checkout(company_owner, client, lines, coupon=None):
+    """
+    Records a whole cart as one sale in a bounded number of queries, independent of its size:
+    prices are resolved in bulk, the SaleItems are bulk_created, the stock is allocated in bulk
+    and the sale total is written once.
+    """
+    cart = _parse_cart_lines(lines)
+    prices = _load_unit_prices(company_owner, cart)
+    _check_prices(cart, prices)
+    _check_stock(company_owner, cart)
+
+    with transaction.atomic():
+        sale = Sale.objects.create(company_owner=company_owner, client=client, coupon=coupon)
+
+        items = _build_sale_items(sale, cart, prices)
+        SaleItem.objects.bulk_create(items)
+        allocate_stock(company_owner, _stock_demands(items, client))
+
+        sale.total_price = _sale_total(items, coupon)
+        Sale.objects.filter(pk=sale.pk).update(total_price=sale.total_price)
+        apply_client_deltas({client.pk: sale.total_price})
+
+        # The sale itself was counted by its post_save signal, at a zero total
+        product_deltas, _ = sale_rollup_deltas([], items)
+        client_deltas = RollupDeltas()
+        client_deltas.add(client_rollup_key(sale), 0, sale.total_price)
+        apply_rollup_deltas(product_deltas, client_deltas)
+
+    return sale
+
+
+############################### Offline batch sync
+
+def build_email_tasks(sale, now_time=None):
+    """
+    Returns the unsaved post-sale EmailTasks (thank you, feedback, recommendation) for a sale.
+    """
+    now_time = now_time or timezone.now()
+    return [
+        EmailTask(sale=sale, email_type="thank_you", time_to_send=now_time),
+        EmailTask(sale=sale, email_type="feedback", time_to_send=now_time + timedelta(days=7)),
+        EmailTask(sale=sale, email_type="recommendation", time_to_send=now_time + timedelta(days=30)),
+    ]
+
+
+def _parse_sold_at(value, now_time):
+    """
+    The time a terminal recorded an offline sale at: an ISO 8601 string, read in the current
+    time zone when it has no offset, that can't be in the future. Defaults to now.
+    """
+    if value in (None, ""):
+        return now_time
+    try:
+        sold_at = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        sold_at = None
+    if sold_at is None:
+        raise CheckoutError(["sold_at must be an ISO 8601 date and time."])
+    if timezone.is_naive(sold_at):
+        sold_at = timezone.make_aware(sold_at)
+    if sold_at > now_time:
+        raise CheckoutError(["sold_at can't be in the future."])
+    return sold_at
+
+
+def _prepare_offline_sales(company_owner, payload):
+    """
+    Validates a batch of offline sales with a fixed number of queries for the whole batch.
+    Returns (entries ready to ingest, their unit prices, already ingested keys, {key: errors}).
+    """
+    now_time = timezone.now()
+    errors = {}
+    entries = []
+    seen_keys = set()
+    for index, raw in enumerate(payload, start=1):
+        if not isinstance(raw, dict):
+            errors[f"#{index}"] = ["Each sale must be an object."]
+            continue
+        if raw.get("coupon_code") is not None and not isinstance(raw["coupon_code"], str):
+            errors[f"#{index}"] = ["coupon_code must be a string."]
+            continue
+        key = str(raw.get("idempotency_key") or "").strip()
+        if not key or len(key) > 64:
+            errors[f"#{index}"] = ["idempotency_key is required (max 64 characters)."]
+            continue
+        if key in seen_keys:
+            errors[key] = ["idempotency_key is repeated in this batch."]
+            continue
+        seen_keys.add(key)
+        try:
+            sold_at = _parse_sold_at(raw.get("sold_at"), now_time)
+            cart = _parse_cart_lines(raw.get("items") or [])
+        except CheckoutError as e:
+            errors[key] = e.errors
+            continue
+        entries.append({"key": key, "raw": raw, "cart": cart, "sold_at": sold_at})
+
+    existing = set(
+        Sale.objects.filter(company_owner=company_owner, idempotency_key__in=[entry["key"] for entry in entries])
+        .values_list('idempotency_key', flat=True)
+    )
+    entries = [entry for entry in entries if entry["key"] not in existing]
+
+    for entry in entries:
+        try:
+            entry["client_id"] = int(entry["raw"].get("client_id"))
+        except (TypeError, ValueError):
+            entry["client_id"] = None
+    clients = Client.objects.filter(
+        company_owner=company_owner, id__in={entry["client_id"] for entry in entries}
+    ).in_bulk()
+    coupons = {
+        coupon.code: coupon
+        for coupon in Coupon.objects.filter(
+            company_owner=company_owner, code__in={entry["raw"].get("coupon_code") for entry in entries}
+        )
+    }
+    prices = _load_unit_prices(company_owner, {key for entry in entries for key in entry["cart"]})
+
+    ready = []
+    for entry in entries:
+        entry_errors = []
+        entry["client"] = clients.get(entry["client_id"])
+        if entry["client"] is None:
+            entry_errors.append("Client does not exist.")
+        entry["coupon"] = None
+        if entry["raw"].get("coupon_code"):
+            entry["coupon"] = coupons.get(entry["raw"]["coupon_code"])
+            if entry["coupon"] is None:
+                entry_errors.append("Coupon does not exist.")
+        try:
+            _check_prices(entry["cart"], prices)
+        except CheckoutError as e:
+            entry_errors.extend(e.errors)
+        if entry_errors:
+            errors[entry["key"]] = entry_errors
+        else:
+            ready.append(entry)
+    return ready, prices, existing, errors
+
+
+def _ingest_sales(company_owner, entries, prices):
+    """
+    Writes a group of validated offline sales with set-based statements: one insert for the
+    sales, one for their items, one for their email tasks and one bulk stock allocation.
+    """
+    now_time = timezone.now()
+    sales = []
+    items = []
+    demands = []
+    for entry in entries:
+        sale = Sale(
+            company_owner=company_owner,
+            client=entry["client"],
+            coupon=entry["coupon"],
+            idempotency_key=entry["key"],
+            sale_time=entry["sold_at"],
+        )
+        sale_items = _build_sale_items(sale, entry["cart"], prices)
+        sale.total_price = _sale_total(sale_items, entry["coupon"])
+        sales.append(sale)
+        items.extend(sale_items)
+        demands.extend(_stock_demands(sale_items, entry["client"]))
+
+    Sale.objects.bulk_create(sales)
+    SaleItem.objects.bulk_create(items)
+    email_tasks = EmailTask.objects.bulk_create([task for sale in sales for task in build_email_tasks(sale, now_time)])
+    notify_email_scheduler(email_tasks)
+    allocate_stock(company_owner, demands)
+
+    deltas = defaultdict(Decimal)
+    for sale in sales:
+        deltas[sale.client_id] += sale.total_price
+    apply_client_deltas(deltas)
+    apply_rollup_deltas(*sale_rollup_deltas(sales, items))
+
+
+def sync_offline_sales(company_owner, payload, chunk_size=None):
+    """
+    Ingests a shift's worth of offline POS sales. Each sale carries an idempotency key so a
+    re-sent upload never records a sale twice, and may carry the time it was made at (sold_at),
+    which dates the sale and its rollups instead of the upload time. Sales are committed in chunks of `chunk_size`,
+    one transaction per chunk; if a chunk fails (short stock, a concurrent upload of the same
+    key), its sales are retried one by one so a single bad sale doesn't reject its neighbours.
+    Client totals move by one delta per client per chunk.
+    """
+    chunk_size = chunk_size or settings.SALES_SYNC_CHUNK_SIZE
+    entries, prices, duplicates, errors = _prepare_offline_sales(company_owner, payload)
+
+    created = []
+    for start in range(0, len(entries), chunk_size):
+        chunk = entries[start:start + chunk_size]
+        try:
+            with transaction.atomic():
+                _ingest_sales(company_owner, chunk, prices)
+            created.extend(entry["key"] for entry in chunk)
+            continue
+        except (InsufficientStockError, IntegrityError):
+            pass
+
+        for entry in chunk:
+            try:
+                with transaction.atomic():
+                    _ingest_sales(company_owner, [entry], prices)
+                created.append(entry["key"])
+            except InsufficientStockError as e:
+                errors[entry["key"]] = [str(e)]
+            except IntegrityError:
+                duplicates.add(entry["key"])
+
+    return {"created": created, "duplicates": sorted(duplicates), "errors": errors}
@@ -1,32 +1,32 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 from .models import *
-from django.utils.timezone import now
-from datetime import timedelta
+from collections import defaultdict
+from decimal import Decimal
+from stock_track.services import StockDemand, allocate_stock
+from .services import (
+    RollupDeltas, apply_client_deltas, apply_rollup_deltas, build_email_tasks, client_rollup_key,
+    product_rollup_key, remove_rollup_deltas, schedule_total_recompute,
+)
 
 
 # Post Sale save signal to automatically create email sending tasks.
 @receiver(post_save, sender=Sale)
 def create_email_tasks(sender, instance, created, **kwargs):
     if created:
-        now_time = now()
-        EmailTask.objects.bulk_create([
-            EmailTask(
-                sale=instance,
-                email_type="thank_you",
-                time_to_send=now_time,
-            ),
-            EmailTask(
-                sale=instance,
-                email_type="feedback",
-                time_to_send=now_time + timedelta(days=7),
-            ),
-            EmailTask(
-                sale=instance,
-                email_type="recommendation",
-                time_to_send=now_time + timedelta(days=30),
-            ),
-        ])
+        email_tasks = EmailTask.objects.bulk_create(build_email_tasks(instance))
+        notify_email_scheduler(email_tasks)
+
+
+@receiver(pre_save, sender=Sale)
+def remember_previous_sale_total(sender, instance, **kwargs):
+    """
+    Keep the stored client and total of an existing sale so the client totals can be moved by a delta.
+    """
+    previous = None
+    if instance.pk:
+        previous = Sale.objects.filter(pk=instance.pk).values('client_id', 'total_price').first()
+    instance._previous_total = previous
 
 
 @receiver(post_save, sender=Sale)
@@ -34,10 +34,18 @@ def update_client_total_spent_on_save(sender, instance, **kwargs):
     """
     Update the client's total spent field when a sale is created or updated.
     """
-    client = instance.client
-    total_spent = client.sales.aggregate(total=Sum('total_price'))['total'] or 0
-    client.total_spent = total_spent
-    client.save()
+    deltas = defaultdict(Decimal)
+    previous = getattr(instance, '_previous_total', None)
+    if previous:
+        deltas[previous['client_id']] -= previous['total_price']
+    deltas[instance.client_id] += Decimal(instance.total_price)
+    apply_client_deltas(deltas)
+
+    rollups = RollupDeltas()
+    if previous:
+        rollups.add(client_rollup_key(instance, previous['client_id']), -1, -previous['total_price'])
+    rollups.add(client_rollup_key(instance), 1, Decimal(instance.total_price))
+    apply_rollup_deltas(client_deltas=rollups)
 
 
 @receiver(post_delete, sender=Sale)
@@ -45,44 +53,73 @@ def update_client_total_spent_on_delete(sender, instance, **kwargs):
     """
     Update the client's total spent field when a sale is deleted.
     """
-    client = instance.client
-    total_spent = client.sales.aggregate(total=Sum('total_price'))['total'] or 0
-    client.total_spent = total_spent
-    client.save()
+    apply_client_deltas({instance.client_id: -Decimal(instance.total_price)})
+
+    rollups = RollupDeltas()
+    rollups.add(client_rollup_key(instance), 1, Decimal(instance.total_price))
+    remove_rollup_deltas(client_deltas=rollups)
+
+
+@receiver(pre_save, sender=SaleItem)
+def remember_previous_sale_item(sender, instance, **kwargs):
+    """
+    Keep the stored product, quantity and total of an existing item so the rollups can be moved by a delta.
+    """
+    previous = None
+    if instance.pk:
+        previous = SaleItem.objects.filter(pk=instance.pk).values(
+            'product_id', 'product_variation_id', 'quantity', 'total_price'
+        ).first()
+    instance._previous_item = previous
+
+
+@receiver(post_save, sender=SaleItem)
+def update_sales_rollups_on_item_save(sender, instance, **kwargs):
+    """
+    Move the item's product rollup by the difference with what was stored before.
+    """
+    rollups = RollupDeltas()
+    previous = getattr(instance, '_previous_item', None)
+    if previous:
+        rollups.add(
+            product_rollup_key(instance.sale, previous['product_id'], previous['product_variation_id']),
+            -previous['quantity'], -previous['total_price'],
+        )
+    rollups.add(
+        product_rollup_key(instance.sale, instance.product_id, instance.product_variation_id),
+        instance.quantity, instance.total_price,
+    )
+    apply_rollup_deltas(product_deltas=rollups)
+
+
+@receiver(post_delete, sender=SaleItem)
+def update_sale_total_on_item_delete(sender, instance, **kwargs):
+    """
+    Update the sale's total price and the product rollup when one of its items is removed.
+    """
+    schedule_total_recompute(instance.sale_id)
+
+    sale = Sale.objects.filter(pk=instance.sale_id).only('company_owner_id', 'sale_time').first()
+    if sale is not None:
+        rollups = RollupDeltas()
+        rollups.add(
+            product_rollup_key(sale, instance.product_id, instance.product_variation_id),
+            instance.quantity, instance.total_price,
+        )
+        remove_rollup_deltas(product_deltas=rollups)
 
 
 # Signal to update inventory and batch when a sale is made
 @receiver(post_save, sender=SaleItem)
 def update_inventory_and_batch(sender, instance, created, **kwargs):
     if created:
-        try:
-            # Update Inventory
-            inventory = Inventory.objects.filter(
-                product=instance.product,
-                product_variation=instance.product_variation,
-                warehouse=instance.sale.company_owner
-            ).first()
-
-            if inventory:
-                if inventory.quantity >= instance.quantity:
-                    inventory.quantity -= instance.quantity
-                    inventory.save()
-
-                    # Log inventory change
-                    InventoryLog.objects.create(
-                        inventory=inventory,
-                        change_quantity=-instance.quantity,
-                        reason=f"Sale to client {instance.sale.client.name}"
-                    )
-                else:
-                    raise ValueError("Insufficient inventory to complete the sale")
-
-            # Update the Batch directly
-            batch = Batch.objects.filter(products=instance.product).order_by('manufacture_date').first()
-            if batch:
-                total_quantity_in_batch = Inventory.objects.filter(batch=batch).aggregate(total=Sum('quantity'))['total']
-                if total_quantity_in_batch is not None and total_quantity_in_batch <= 0:
-                    batch.products.remove(instance.product)
-        except Exception as e:
-            # Error Handling
-            print(f"Error updating inventory and batch: {e}")
+        # Split the sold quantity across batches/warehouses (FEFO or FIFO); an
+        # InsufficientStockError rolls back the whole sale
+        allocate_stock(instance.sale.company_owner, [
+            StockDemand(
+                product_id=instance.product_id,
+                product_variation_id=instance.product_variation_id,
+                quantity=instance.quantity,
+                reason=f"Sale to client {instance.sale.client.name}",
+            )
+        ])
@@ -1,3 +1,147 @@
+from datetime import timedelta
+from decimal import Decimal
+
 from django.test import TestCase
+from django.utils import timezone
+
+from profiles.models import Client, CustomUser
+from stock_track.models import Batch, Category, Inventory, Product, Warehouse
+from stock_track.services import ReceiptLine, receive_stock
+from .models import Coupon, DailyClientSales, DailyProductSales, Sale
+from .services import CheckoutError, checkout, sync_offline_sales
+
+
+class SalesTestData:
+    """
+    An owner with one client, one product and 100 units of it in one warehouse.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = CustomUser.objects.create_user(username="owner", password="secret")
+        cls.client_obj = Client.objects.create(company_owner=cls.owner, name="Client")
+        category = Category.objects.create(company_owner=cls.owner, name="Category")
+        cls.product = Product.objects.create(
+            company_owner=cls.owner, name="Product", category=category, sku="SKU-1", price=Decimal("2.50")
+        )
+        cls.warehouse = Warehouse.objects.create(company_owner=cls.owner, name="Warehouse")
+        cls.batch = Batch.objects.create(company_owner=cls.owner, batch_number="B-1")
+        receive_stock(cls.owner, cls.warehouse, [ReceiptLine(cls.product.pk, None, cls.batch.pk, Decimal("100"))])
+
+    def sell(self, quantity):
+        return checkout(self.owner, self.client_obj, [{"product_id": self.product.pk, "quantity": quantity}])
+
+
+class CheckoutTests(SalesTestData, TestCase):
+    def test_checkout_records_the_sale_and_takes_the_stock(self):
+        sale = self.sell(4)
+
+        self.assertEqual(sale.total_price, Decimal("10.00"))
+        self.assertEqual(sale.items.get().quantity, Decimal("4"))
+        self.assertEqual(Inventory.objects.get(product=self.product).quantity, Decimal("96"))
+        self.client_obj.refresh_from_db()
+        self.assertEqual(self.client_obj.total_spent, Decimal("10.00"))
+
+    def test_discounted_total_is_rounded_to_cents(self):
+        coupon = Coupon.objects.create(company_owner=self.owner, code="SAVE15", discount_percentage=Decimal("15"))
+        sale = checkout(self.owner, self.client_obj, [{"product_id": self.product.pk, "quantity": 1}], coupon)
+
+        self.assertEqual(sale.total_price, Decimal("2.13"))
+        sale.refresh_from_db()
+        self.assertEqual(sale.total_price, Decimal("2.13"))
+
+    def test_checkout_beyond_the_stock_writes_nothing(self):
+        with self.assertRaises(CheckoutError):
+            self.sell(101)
+
+        self.assertFalse(Sale.objects.exists())
+        self.assertEqual(Inventory.objects.get(product=self.product).quantity, Decimal("100"))
+
+
+class OfflineSyncTests(SalesTestData, TestCase):
+    def offline_sale(self, key, **fields):
+        return {
+            "idempotency_key": key,
+            "client_id": self.client_obj.pk,
+            "items": [{"product_id": self.product.pk, "quantity": 1}],
+            **fields,
+        }
+
+    def test_a_resent_upload_is_recorded_once(self):
+        payload = [self.offline_sale("pos-1"), self.offline_sale("pos-2")]
+        first = sync_offline_sales(self.owner, payload)
+        second = sync_offline_sales(self.owner, payload)
+
+        self.assertEqual(sorted(first["created"]), ["pos-1", "pos-2"])
+        self.assertEqual(second["created"], [])
+        self.assertEqual(second["duplicates"], ["pos-1", "pos-2"])
+        self.assertEqual(Sale.objects.count(), 2)
+        self.assertEqual(Inventory.objects.get(product=self.product).quantity, Decimal("98"))
+        self.assertEqual(DailyClientSales.objects.get(company_owner=self.owner).sale_count, 2)
+
+    def test_a_repeated_key_in_one_upload_is_rejected(self):
+        result = sync_offline_sales(self.owner, [self.offline_sale("pos-1"), self.offline_sale("pos-1")])
+
+        self.assertEqual(result["created"], ["pos-1"])
+        self.assertIn("pos-1", result["errors"])
+        self.assertEqual(Sale.objects.count(), 1)
+
+    def test_sold_at_dates_the_sale_and_its_rollups(self):
+        sold_at = timezone.now() - timedelta(days=2)
+        sync_offline_sales(self.owner, [self.offline_sale("pos-1", sold_at=sold_at.isoformat())])
+
+        self.assertEqual(Sale.objects.get().sale_time, sold_at)
+        self.assertTrue(DailyClientSales.objects.filter(day=timezone.localdate(sold_at)).exists())
+
+    def test_sold_at_in_the_future_is_rejected(self):
+        sold_at = timezone.now() + timedelta(days=1)
+        result = sync_offline_sales(self.owner, [self.offline_sale("pos-1", sold_at=sold_at.isoformat())])
+
+        self.assertEqual(result["created"], [])
+        self.assertIn("pos-1", result["errors"])
+
+
+class RollupEditTests(SalesTestData, TestCase):
+    def test_editing_an_item_moves_the_rollups_by_the_difference(self):
+        sale = self.sell(2)
+        item = sale.items.get()
+        item.quantity = Decimal("5")
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+
+        product_rollup = DailyProductSales.objects.get(company_owner=self.owner, product=self.product)
+        self.assertEqual(product_rollup.quantity, Decimal("5"))
+        self.assertEqual(product_rollup.revenue, Decimal("12.50"))
+        client_rollup = DailyClientSales.objects.get(company_owner=self.owner)
+        self.assertEqual(client_rollup.sale_count, 1)
+        self.assertEqual(client_rollup.revenue, Decimal("12.50"))
+        self.client_obj.refresh_from_db()
+        self.assertEqual(self.client_obj.total_spent, Decimal("12.50"))
+
+
+class RollupDeleteTests(SalesTestData, TestCase):
+    def test_deleting_a_sale_takes_it_off_the_rollups(self):
+        self.sell(2)
+        sale = self.sell(3)
+        sale.delete()
+
+        today = timezone.localdate()
+        client_rollup = DailyClientSales.objects.get(company_owner=self.owner, day=today, client=self.client_obj)
+        self.assertEqual(client_rollup.sale_count, 1)
+        self.assertEqual(client_rollup.revenue, Decimal("5.00"))
+        product_rollup = DailyProductSales.objects.get(company_owner=self.owner, day=today, product=self.product)
+        self.assertEqual(product_rollup.quantity, Decimal("2"))
+
+    def test_deleting_a_client_with_sales(self):
+        self.sell(2)
+        self.client_obj.delete()
+
+        self.assertFalse(DailyClientSales.objects.filter(company_owner=self.owner).exists())
+        self.assertEqual(DailyProductSales.objects.get(company_owner=self.owner).quantity, 0)
+
+    def test_deleting_a_sold_product(self):
+        self.sell(2)
+        self.product.delete()
 
-# Create your tests here.
+        self.assertFalse(DailyProductSales.objects.filter(company_owner=self.owner).exists())
+        self.assertEqual(DailyClientSales.objects.get(company_owner=self.owner).sale_count, 1)
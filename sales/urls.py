@@ -14,4 +14,9 @@ urlpatterns = [
 		path("", views.sales_list, name="list"),
     path("delete/<int:sale_id>/", views.delete_sale, name="delete"),
 		path("edit/<int:sale_id>/", views.edit_sale, name="edit_sale"),
+		path("reports/", views.sales_report, name="report"),
+
+		# POS API
+		path("api/checkout/", views.checkout_api, name="checkout_api"),
+		path("api/sync/", views.sync_sales_api, name="sync_sales_api"),
 ]
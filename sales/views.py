@@ -1,10 +1,21 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from .models import Coupon, SaleItem
+from .models import Coupon, SaleItem, DailyClientSales, DailyProductSales
 from .forms import *
 from django.forms import inlineformset_factory
 from django.db import transaction
+from django.http import JsonResponse
+from django.db.models import Sum
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek, TruncYear
+from django.utils.dateparse import parse_date
+from django.utils.timezone import localdate
+from datetime import timedelta
+from django.views.decorators.http import require_POST
+from profiles.models import Client
+from stock_track.services import InsufficientStockError
+from .services import CheckoutError, checkout, sync_offline_sales
+import json
 
 
 @login_required
@@ -62,22 +73,27 @@ def add_sale(request):
         formset = SaleItemFormSet(request.POST)
 
         if sale_form.is_valid() and formset.is_valid():
-            # Save the sale first
-            sale = sale_form.save(commit=False)
-            sale.company_owner = request.user
-            sale.save()
-
-            # Save the sale items
-            sale_items = formset.save(commit=False)
-            for item in sale_items:
-                item.sale = sale
-                item.save()
-
-            # Update the total price of the sale
-            sale.update_total_price()
-
-            messages.success(request, "Sale added successfully!")
-            return redirect("sales:list")  # Update with the correct URL name for listing sales
+            try:
+                # The sale, its items and the stock decrements commit or roll back together
+                with transaction.atomic():
+                    # Save the sale first
+                    sale = sale_form.save(commit=False)
+                    sale.company_owner = request.user
+                    sale.save()
+
+                    # Save the sale items
+                    sale_items = formset.save(commit=False)
+                    for item in sale_items:
+                        item.sale = sale
+                        item.save()
+
+                    # Update the total price of the sale
+                    sale.update_total_price()
+            except InsufficientStockError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, "Sale added successfully!")
+                return redirect("sales:list")  # Update with the correct URL name for listing sales
         else:
             messages.error(request, "Please correct the errors below.")
 
@@ -118,19 +134,24 @@ def edit_sale(request, sale_id):
         formset = SaleItemFormSet(request.POST, instance=sale)
 
         if sale_form.is_valid() and formset.is_valid():
-            sale = sale_form.save(commit=False)
-            sale.company_owner = request.user
-            sale.save()
-
-            # Save SaleItems
-            sale_items = formset.save(commit=False)
-            for item in sale_items:
-                item.sale = sale
-                item.save()
-
-            sale.update_total_price()
-            messages.success(request, "Sale updated successfully!")
-            return redirect("sales:list")  # Adjust with your actual URL name
+            try:
+                with transaction.atomic():
+                    sale = sale_form.save(commit=False)
+                    sale.company_owner = request.user
+                    sale.save()
+
+                    # Save SaleItems
+                    sale_items = formset.save(commit=False)
+                    for item in sale_items:
+                        item.sale = sale
+                        item.save()
+
+                    sale.update_total_price()
+            except InsufficientStockError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, "Sale updated successfully!")
+                return redirect("sales:list")  # Adjust with your actual URL name
 
         else:
             messages.error(request, "Please correct the errors below.")
@@ -147,3 +168,100 @@ def edit_sale(request, sale_id):
     }
     return render(request, "sales/edit_sale.html", context)
 
+
+
+# JSON checkout for POS terminals: records a whole cart as one sale
+@login_required
+@require_POST
+def checkout_api(request):
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"errors": ["Request body must be valid JSON."]}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"errors": ["Request body must be a JSON object."]}, status=400)
+
+    client_id = payload.get("client_id")
+    client = None
+    if (isinstance(client_id, int) and not isinstance(client_id, bool)) or (isinstance(client_id, str) and client_id.isdigit()):
+        client = Client.objects.filter(id=client_id, company_owner=request.user).first()
+    if client is None:
+        return JsonResponse({"errors": ["Client does not exist."]}, status=400)
+
+    coupon = None
+    if payload.get("coupon_code"):
+        coupon = Coupon.objects.filter(code=str(payload["coupon_code"]), company_owner=request.user).first()
+        if coupon is None or not coupon.is_valid():
+            return JsonResponse({"errors": ["Coupon is invalid or expired."]}, status=400)
+
+    try:
+        sale = checkout(request.user, client, payload.get("items") or [], coupon=coupon)
+    except CheckoutError as e:
+        return JsonResponse({"errors": e.errors}, status=400)
+    except InsufficientStockError as e:
+        return JsonResponse({"errors": [str(e)]}, status=409)
+
+    return JsonResponse({"sale_id": sale.id, "total_price": str(sale.total_price)}, status=201)
+
+
+# Batch upload of sales recorded while a POS terminal was offline
+@login_required
+@require_POST
+def sync_sales_api(request):
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"errors": ["Request body must be valid JSON."]}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({"errors": ["Request body must be a JSON object."]}, status=400)
+
+    sales = payload.get("sales")
+    if not isinstance(sales, list):
+        return JsonResponse({"errors": ["'sales' must be a list."]}, status=400)
+
+    result = sync_offline_sales(request.user, sales)
+    return JsonResponse(result)
+
+
+# Sales reports D/W/M/Y, read from the daily rollup tables
+REPORT_PERIODS = {
+    "daily": (TruncDay, timedelta(days=30)),
+    "weekly": (TruncWeek, timedelta(weeks=12)),
+    "monthly": (TruncMonth, timedelta(days=365)),
+    "yearly": (TruncYear, timedelta(days=5 * 365)),
+}
+
+
+@login_required
+def sales_report(request):
+    period = request.GET.get("period", "daily")
+    if period not in REPORT_PERIODS:
+        period = "daily"
+    trunc, default_span = REPORT_PERIODS[period]
+
+    end = parse_date(request.GET.get("end") or "") or localdate()
+    start = parse_date(request.GET.get("start") or "") or end - default_span
+
+    totals = (
+        DailyClientSales.objects.filter(company_owner=request.user, day__range=(start, end))
+        .annotate(period=trunc('day'))
+        .values('period')
+        .annotate(sale_count=Sum('sale_count'), revenue=Sum('revenue'))
+        .order_by('period')
+    )
+    top_products = (
+        DailyProductSales.objects.filter(company_owner=request.user, day__range=(start, end))
+        .values('product__name', 'product_variation__name')
+        .annotate(quantity=Sum('quantity'), revenue=Sum('revenue'))
+        .order_by('-revenue')[:10]
+    )
+
+    context = {
+        "period": period,
+        "periods": REPORT_PERIODS.keys(),
+        "start": start,
+        "end": end,
+        "totals": totals,
+        "top_products": top_products,
+    }
+    return render(request, "sales/sales_report.html", context)
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import *
+from .alerts import record_threshold_crossings
 
 
 @admin.register(Warehouse)
@@ -44,6 +45,23 @@ class InventoryAdmin(admin.ModelAdmin):
     inlines = [InventoryLogInline]
     list_filter = ('company_owner',)
 
+    def save_model(self, request, obj, form, change):
+        # The admin already wraps the save in a transaction, so the event commits with it
+        super().save_model(request, obj, form, change)
+        if not change and obj.quantity:
+            # The opening quantity, so the ledger adds up to the row from its first save
+            InventoryLog.objects.create(inventory=obj, change_quantity=obj.quantity, reason="Added in admin")
+        elif change and 'quantity' in form.changed_data:
+            # Keep the ledger complete, point-in-time balances are computed from it
+            InventoryLog.objects.create(
+                inventory=obj,
+                change_quantity=obj.quantity - form.initial['quantity'],
+                reason="Edited in admin",
+            )
+            record_threshold_crossings([
+                (obj, form.initial['quantity'], obj.product.stock_alert_threshold)
+            ])
+
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('company_owner', 'name', 'description', 'created_at')
@@ -51,3 +69,23 @@ class CategoryAdmin(admin.ModelAdmin):
 
 
 
+
+@admin.register(StockTransfer)
+class StockTransferAdmin(admin.ModelAdmin):
+    list_display = ('company_owner', 'from_warehouse', 'to_warehouse', 'created_at')
+    list_filter = ('company_owner', 'from_warehouse', 'to_warehouse')
+
+@admin.register(StockThresholdEvent)
+class StockThresholdEventAdmin(admin.ModelAdmin):
+    list_display = ('company_owner', 'inventory', 'level', 'quantity', 'threshold', 'created_at')
+    list_filter = ('company_owner', 'level')
+
+@admin.register(StockLevel)
+class StockLevelAdmin(admin.ModelAdmin):
+    list_display = ('company_owner', 'product', 'product_variation', 'warehouse', 'quantity', 'updated_at')
+    list_filter = ('company_owner', 'warehouse')
+
+@admin.register(InventorySnapshot)
+class InventorySnapshotAdmin(admin.ModelAdmin):
+    list_display = ('company_owner', 'inventory', 'quantity', 'taken_at')
+    list_filter = ('company_owner', 'taken_at')
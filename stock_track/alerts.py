@@ -0,0 +1,96 @@
+from typing import NamedTuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import AlertState, StockThresholdEvent
+
+
+class AlertCondition(NamedTuple):
+    """
+    An alert condition that currently holds for one object.
+    """
+    fingerprint: str
+    alert_type: str
+    company_owner_id: int
+    object_id: int
+    threshold: str
+    payload: object  # Returned as-is when the condition is newly raised
+
+
+def fingerprint(alert_type, object_id, threshold=""):
+    return f"{alert_type}:{object_id}:{threshold}"
+
+
+def record_transitions(alert_types, object_ids, conditions):
+    """
+    Compares the conditions that hold now for the evaluated `object_ids` with the stored alert
+    states. Conditions without an active state are raised, active states of those objects whose
+    condition no longer holds are cleared. Returns the payloads of the newly raised conditions.
+    """
+    now_time = timezone.now()
+    conditions = {condition.fingerprint: condition for condition in conditions}
+
+    active = dict(
+        AlertState.objects.filter(alert_type__in=alert_types, object_id__in=object_ids, is_active=True)
+        .values_list('fingerprint', 'id')
+    )
+    raised = [condition for key, condition in conditions.items() if key not in active]
+    cleared = [state_id for key, state_id in active.items() if key not in conditions]
+
+    with transaction.atomic():
+        if cleared:
+            AlertState.objects.filter(id__in=cleared).update(is_active=False, cleared_at=now_time)
+        if raised:
+            AlertState.objects.bulk_create(
+                [
+                    AlertState(
+                        company_owner_id=condition.company_owner_id,
+                        fingerprint=condition.fingerprint,
+                        alert_type=condition.alert_type,
+                        object_id=condition.object_id,
+                        threshold=condition.threshold,
+                        is_active=True,
+                        raised_at=now_time,
+                        cleared_at=None,
+                    )
+                    for condition in raised
+                ],
+                update_conflicts=True,
+                unique_fields=['fingerprint'],
+                update_fields=['is_active', 'raised_at', 'cleared_at'],
+            )
+
+    return [condition.payload for condition in raised]
+
+
+def stock_level(quantity, threshold):
+    if quantity <= 0:
+        return "out_of_stock"
+    if quantity < threshold:
+        return "low_stock"
+    return "in_stock"
+
+
+def record_threshold_crossings(changes):
+    """
+    Appends a StockThresholdEvent for every inventory row whose stock level changed with a write.
+
+    `changes` holds (inventory, previous_quantity, threshold) for the rows a mutation just wrote,
+    with inventory.quantity already set to the new value. previous_quantity is None for rows the
+    write created, which have no level to cross from. Must be called inside the write's
+    transaction so the events commit (or roll back) with it. Returns the created events.
+    """
+    events = [
+        StockThresholdEvent(
+            company_owner_id=inventory.company_owner_id,
+            inventory=inventory,
+            level=stock_level(inventory.quantity, threshold),
+            quantity=inventory.quantity,
+            threshold=threshold,
+        )
+        for inventory, previous_quantity, threshold in changes
+        if previous_quantity is not None
+        and stock_level(inventory.quantity, threshold) != stock_level(previous_quantity, threshold)
+    ]
+    return StockThresholdEvent.objects.bulk_create(events) if events else []
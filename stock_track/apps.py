@@ -5,3 +5,6 @@ class StockTrackConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stock_track'
     verbose_name = "Inventory Management"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import ChangeCursor
+
+
+def lock_cursor(name):
+    """
+    Returns the named ChangeCursor locked for the rest of the transaction, creating it if needed,
+    so two overlapping runs of the same consumer can't process the same changes.
+    """
+    ChangeCursor.objects.get_or_create(name=name)
+    return ChangeCursor.objects.select_for_update().get(name=name)
+
+
+def settled_transaction_horizon():
+    """
+    Id of the oldest transaction still in progress. Every transaction with a lower id has
+    committed or rolled back, so the feed rows they wrote (their `txid`) are all visible for good.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+        return cursor.fetchone()[0]
+
+
+def _row_position(row):
+    if isinstance(row, dict):
+        return row['txid'], row['id']
+    return row.txid, row.pk
+
+
+def consume_changes(consumer, queryset, handle_page, page_size=None, from_start=False):
+    """
+    Streams the rows of `queryset` that `consumer` hasn't processed yet, in (txid, id) order and
+    in pages of `page_size`, and passes each page to `handle_page`. The rows must carry the
+    `txid` column (the inserting transaction, see CurrentTransactionId) and, for values()
+    querysets, select both 'txid' and 'id'.
+
+    Only rows of transactions below settled_transaction_horizon() are read. A transaction that
+    is still open, however long, can't commit a row behind the cursor, so no row is ever skipped.
+    Every page is handled in the same transaction that advances the consumer's cursor
+    (ChangeCursor.last_txid/last_id), so a page is processed exactly once however late, early
+    or often the consumer runs. Emails should be queued in the outbox (email_tasks.outbox)
+    inside `handle_page`, so they commit together with the cursor.
+
+    A new consumer starts at the current end of the feed unless `from_start` is set.
+    Returns the number of rows processed.
+    """
+    page_size = page_size or settings.CHANGE_FEED_PAGE_SIZE
+    queryset = queryset.filter(txid__lt=settled_transaction_horizon())
+
+    if not from_start and not ChangeCursor.objects.filter(name=consumer).exists():
+        last = queryset.order_by('-txid', '-id').first()
+        last_txid, last_id = _row_position(last) if last else (0, 0)
+        ChangeCursor.objects.get_or_create(name=consumer, defaults={'last_txid': last_txid, 'last_id': last_id})
+
+    processed = 0
+    while True:
+        with transaction.atomic():
+            cursor = lock_cursor(consumer)
+            page = list(
+                queryset.filter(
+                    Q(txid__gt=cursor.last_txid) | Q(txid=cursor.last_txid, id__gt=cursor.last_id)
+                ).order_by('txid', 'id')[:page_size]
+            )
+            if not page:
+                break
+
+            handle_page(page)
+
+            cursor.last_txid, cursor.last_id = _row_position(page[-1])
+            cursor.save(update_fields=['last_txid', 'last_id', 'updated_at'])
+
+        processed += len(page)
+        if len(page) < page_size:
+            break
+    return processed
@@ -1,6 +1,7 @@
 from django import forms
 from .models import *
-from django.forms import inlineformset_factory
+from django.forms import formset_factory, inlineformset_factory
+from .importer import IMPORT_COLUMNS
 
 class BatchForm(forms.ModelForm):
     class Meta:
@@ -87,6 +88,80 @@ class InventoryForm(forms.ModelForm):
             self.fields['warehouse'].queryset = Warehouse.objects.filter(company_owner=user)
 
 
+class ReceiptLineForm(forms.Form):
+    product = forms.ModelChoiceField(queryset=Product.objects.none(), label="Product")
+    product_variation = forms.ModelChoiceField(
+        queryset=ProductVariation.objects.none(), required=False, label="Product Variation",
+        help_text="Leave empty if the product has no variation"
+    )
+    batch = forms.ModelChoiceField(queryset=Batch.objects.none(), label="Batch")
+    quantity = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0.01, label="Quantity")
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('company_owner', None)
+        super().__init__(*args, **kwargs)
+
+        if user:
+            self.fields['product'].queryset = Product.objects.filter(company_owner=user)
+            self.fields['product_variation'].queryset = ProductVariation.objects.filter(
+                product__company_owner=user
+            )
+            self.fields['batch'].queryset = Batch.objects.filter(company_owner=user)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        product, variation = cleaned_data.get('product'), cleaned_data.get('product_variation')
+        if product and variation and variation.product_id != product.id:
+            raise forms.ValidationError("The variation does not belong to the selected product.")
+        return cleaned_data
+
+
+class InventoryReceiptForm(ReceiptLineForm):
+    """
+    A single receipt line together with its warehouse, used to add inventory.
+    """
+    warehouse = forms.ModelChoiceField(queryset=Warehouse.objects.none(), label="Warehouse")
+    field_order = ['product', 'product_variation', 'batch', 'warehouse', 'quantity']
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.get('company_owner')
+        super().__init__(*args, **kwargs)
+
+        if user:
+            self.fields['warehouse'].queryset = Warehouse.objects.filter(company_owner=user)
+
+
+class GoodsReceiptForm(forms.Form):
+    warehouse = forms.ModelChoiceField(queryset=Warehouse.objects.none(), label="Warehouse")
+    reason = forms.CharField(
+        required=False, label="Reason",
+        widget=forms.Textarea(attrs={'rows': 2, 'placeholder': 'Delivery note, supplier reference...'}),
+    )
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('company_owner', None)
+        super().__init__(*args, **kwargs)
+
+        if user:
+            self.fields['warehouse'].queryset = Warehouse.objects.filter(company_owner=user)
+
+ReceiptLineFormSet = formset_factory(ReceiptLineForm, extra=5)
+
+
+class CatalogueImportForm(forms.Form):
+    file = forms.FileField(
+        label="Spreadsheet",
+        help_text="A .csv or .xlsx file with a header row: " + ", ".join(IMPORT_COLUMNS),
+        widget=forms.ClearableFileInput(attrs={'accept': '.csv,.xlsx'}),
+    )
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if not file.name.lower().endswith(('.csv', '.xlsx')):
+            raise forms.ValidationError("Upload a .csv or .xlsx file.")
+        return file
+
+
 class InventoryLogForm(forms.ModelForm):
     class Meta:
         model = InventoryLog
@@ -95,3 +170,42 @@ class InventoryLogForm(forms.ModelForm):
             'reason': forms.Textarea(attrs={'rows': 4, 'placeholder': 'Reason for updating inventory...'}),
         }
 
+
+
+class StockTransferForm(forms.ModelForm):
+    class Meta:
+        model = StockTransfer
+        fields = ['from_warehouse', 'to_warehouse', 'note']
+        widgets = {
+            'note': forms.Textarea(attrs={'rows': 2, 'placeholder': 'Reason for the transfer...'}),
+        }
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('company_owner', None)
+        super().__init__(*args, **kwargs)
+
+        if user:
+            self.fields['from_warehouse'].queryset = Warehouse.objects.filter(company_owner=user)
+            self.fields['to_warehouse'].queryset = Warehouse.objects.filter(company_owner=user)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('from_warehouse') and cleaned_data.get('from_warehouse') == cleaned_data.get('to_warehouse'):
+            raise forms.ValidationError("Choose two different warehouses for a transfer.")
+        return cleaned_data
+
+
+class TransferLineForm(forms.Form):
+    inventory = forms.ModelChoiceField(queryset=Inventory.objects.none(), label="Inventory")
+    quantity = forms.DecimalField(max_digits=10, decimal_places=2, min_value=0.01, label="Quantity")
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('company_owner', None)
+        super().__init__(*args, **kwargs)
+
+        if user:
+            self.fields['inventory'].queryset = Inventory.objects.filter(
+                company_owner=user, quantity__gt=0
+            ).select_related('product', 'batch', 'warehouse')
+
+TransferLineFormSet = formset_factory(TransferLineForm, extra=3)
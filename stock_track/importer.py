@@ -0,0 +1,395 @@
+import csv
+import io
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, transaction
+from django.utils.dateparse import parse_date
+from openpyxl import load_workbook
+
+from .models import Batch, Category, Inventory, Product, ProductVariation, Supplier, Warehouse
+from .services import ReceiptLine, receive_stock
+
+# Spreadsheet columns, one row per product, optionally with a variation, a batch and the
+# quantity of it held in a warehouse. Only sku is always required; name, category and price
+# are required for new products.
+IMPORT_COLUMNS = [
+    "sku", "name", "category", "price", "description", "stock_alert_threshold",
+    "variation_sku", "variation_name", "variation_price",
+    "batch_number", "supplier", "manufacture_date", "expiry_date",
+    "warehouse", "quantity",
+]
+
+
+# The model field each column is stored in, checked before any row reaches the database
+COLUMN_FIELDS = {
+    "sku": (Product, "sku"),
+    "name": (Product, "name"),
+    "category": (Category, "name"),
+    "price": (Product, "price"),
+    "stock_alert_threshold": (Product, "stock_alert_threshold"),
+    "variation_sku": (ProductVariation, "sku"),
+    "variation_name": (ProductVariation, "name"),
+    "variation_price": (ProductVariation, "price"),
+    "batch_number": (Batch, "batch_number"),
+    "supplier": (Supplier, "name"),
+    "warehouse": (Warehouse, "name"),
+    "quantity": (Inventory, "quantity"),
+}
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def iter_rows(file, filename):
+    """
+    Yields (row number, {column: value}) for every non-empty row of a CSV or XLSX upload,
+    reading it as a stream rather than loading the whole file. Column names are matched
+    case-insensitively.
+    """
+    if filename.lower().endswith(".xlsx"):
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(name or "").strip().lower() for name in next(rows, ())]
+            for number, values in enumerate(rows, start=2):
+                if any(value not in (None, "") for value in values):
+                    yield number, dict(zip(header, values))
+        finally:
+            workbook.close()
+    elif filename.lower().endswith(".csv"):
+        reader = csv.reader(io.TextIOWrapper(file, encoding="utf-8-sig", newline=""))
+        header = [name.strip().lower() for name in next(reader, [])]
+        for number, values in enumerate(reader, start=2):
+            if any(value.strip() for value in values):
+                yield number, dict(zip(header, values))
+    else:
+        raise ValueError("Upload a .csv or .xlsx file.")
+
+
+def _text(row, column):
+    value = row.get(column)
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _decimal(row, column):
+    value = _text(row, column)
+    if not value:
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        number = None
+    if number is None or not number.is_finite():
+        raise ImportRowError(f"{column} must be a number.")
+    return number
+
+
+def _date(row, column):
+    value = row.get(column)
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = _text(row, column)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ImportRowError(f"{column} must be a date (YYYY-MM-DD).")
+    return parsed
+
+
+def _parse_row(row):
+    parsed = {column: _text(row, column) for column in IMPORT_COLUMNS}
+    if not parsed["sku"]:
+        raise ImportRowError("sku is required.")
+    for column in ("price", "variation_price", "quantity"):
+        parsed[column] = _decimal(row, column)
+    threshold = _decimal(row, "stock_alert_threshold")
+    if threshold is not None and (threshold < 0 or threshold != threshold.to_integral_value()):
+        raise ImportRowError("stock_alert_threshold must be a whole number.")
+    parsed["stock_alert_threshold"] = int(threshold) if threshold is not None else None
+    parsed["manufacture_date"] = _date(row, "manufacture_date")
+    parsed["expiry_date"] = _date(row, "expiry_date")
+
+    for column, (model, field_name) in COLUMN_FIELDS.items():
+        if parsed[column] in ("", None):
+            continue
+        field = model._meta.get_field(field_name)
+        try:
+            if isinstance(parsed[column], Decimal):
+                # Rounded like the database would, then checked against max_digits
+                parsed[column] = parsed[column].quantize(Decimal(1).scaleb(-field.decimal_places), ROUND_HALF_UP)
+            field.run_validators(parsed[column])
+        except InvalidOperation:
+            raise ImportRowError(f"{column} is too large.")
+        except ValidationError as e:
+            raise ImportRowError(f"{column}: {' '.join(e.messages)}")
+
+    if parsed["variation_sku"] and (not parsed["variation_name"] or parsed["variation_price"] is None):
+        raise ImportRowError("variation_name and variation_price are required with variation_sku.")
+    if parsed["quantity"] is not None:
+        if parsed["quantity"] <= 0:
+            raise ImportRowError("quantity must be greater than zero.")
+        if not parsed["warehouse"] or not parsed["batch_number"]:
+            raise ImportRowError("warehouse and batch_number are required with quantity.")
+    return parsed
+
+
+class CatalogueImporter:
+    """
+    Imports rows of IMPORT_COLUMNS for one owner, IMPORT_CHUNK_SIZE rows per transaction.
+
+    Categories, suppliers, warehouses, batches, products and variations are resolved by name
+    (or sku / batch number) through maps loaded with one query each, and missing ones are
+    created. Products and variations are upserted on sku and stock is booked through
+    receive_stock, so every chunk costs a fixed number of statements whatever its size.
+    A row that can't be imported is skipped and reported with its row number.
+    """
+
+    def __init__(self, company_owner, reason=None, chunk_size=None):
+        self.company_owner = company_owner
+        self.reason = reason or "Spreadsheet import"
+        self.chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+        self.errors = []
+        self.counts = defaultdict(int, rows=0)
+        self.load_lookups()
+
+    def load_lookups(self):
+        owner = self.company_owner
+        self.categories = dict(Category.objects.filter(company_owner=owner).values_list('name', 'id'))
+        self.suppliers = dict(Supplier.objects.filter(company_owner=owner).values_list('name', 'id'))
+        self.warehouses = dict(Warehouse.objects.filter(company_owner=owner).values_list('name', 'id'))
+        self.batches = dict(Batch.objects.filter(company_owner=owner).values_list('batch_number', 'id'))
+        self.products = dict(Product.objects.filter(company_owner=owner).values_list('sku', 'id'))
+        self.variations = {
+            sku: (variation_id, product_id)
+            for sku, variation_id, product_id in ProductVariation.objects.filter(
+                product__company_owner=owner
+            ).values_list('sku', 'id', 'product_id')
+        }
+
+    def run(self, rows):
+        """
+        Imports an iterable of (row number, {column: value}) and returns the summary counts and
+        the per-row errors.
+        """
+        chunk = []
+        for number, row in rows:
+            self.counts["rows"] += 1
+            try:
+                chunk.append((number, _parse_row(row)))
+            except ImportRowError as e:
+                self.errors.append((number, str(e)))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return {**self.counts, "errors": self.errors}
+
+    def import_chunk(self, rows):
+        counts, error_count = dict(self.counts), len(self.errors)
+        try:
+            with transaction.atomic():
+                accepted = self.resolve_names(rows)
+                accepted = self.save_products(accepted)
+                accepted = self.save_variations(accepted)
+                self.save_stock(accepted)
+        except (ValueError, DatabaseError) as e:
+            # The chunk was rolled back: drop its counts, errors and the ids it added to the lookups
+            self.counts = defaultdict(int, counts)
+            del self.errors[error_count:]
+            self.load_lookups()
+            self.errors.extend((number, f"Not imported: {e}") for number, _ in rows)
+
+    def _create_missing(self, rows, column, model, lookup, field="name", defaults=None):
+        """
+        Creates the `model` rows named in `column` that aren't in `lookup` yet, in one insert.
+        For globally unique names, rows naming one that another owner already has are rejected.
+        """
+        missing = {row[column] for _, row in rows if row[column] and row[column] not in lookup}
+        if not missing:
+            return rows
+
+        taken = set()
+        if model._meta.get_field(field).unique:
+            taken = set(model.objects.filter(**{f"{field}__in": missing}).values_list(field, flat=True))
+        created = model.objects.bulk_create([
+            model(company_owner=self.company_owner, **{field: name}, **(defaults(name) if defaults else {}))
+            for name in missing - taken
+        ])
+        for instance in created:
+            lookup[getattr(instance, field)] = instance.pk
+        self.counts[f"{model._meta.verbose_name_plural.lower()} created"] += len(created)
+
+        accepted = []
+        for number, row in rows:
+            if row[column] in taken:
+                self.errors.append((number, f"{column} '{row[column]}' is used by another account."))
+            else:
+                accepted.append((number, row))
+        return accepted
+
+    def resolve_names(self, rows):
+        rows = self._create_missing(rows, "category", Category, self.categories)
+        rows = self._create_missing(rows, "supplier", Supplier, self.suppliers)
+        rows = self._create_missing(rows, "warehouse", Warehouse, self.warehouses)
+
+        # The first row mentioning a new batch number sets its supplier and dates
+        batch_rows = {}
+        for _, row in rows:
+            batch_rows.setdefault(row["batch_number"], row)
+        return self._create_missing(
+            rows, "batch_number", Batch, self.batches, field="batch_number",
+            defaults=lambda number: {
+                "supplier_id": self.suppliers.get(batch_rows[number]["supplier"]),
+                "manufacture_date": batch_rows[number]["manufacture_date"],
+                "expiry_date": batch_rows[number]["expiry_date"],
+            },
+        )
+
+    def save_products(self, rows):
+        """
+        Upserts the chunk's products on sku. Empty cells leave the product's value as it is,
+        and a later row of the same sku wins over an earlier one.
+        """
+        new_skus = {row["sku"] for _, row in rows if row["sku"] not in self.products}
+        taken = set(Product.objects.filter(sku__in=new_skus).values_list('sku', flat=True))
+
+        updates = {}
+        accepted = []
+        for number, row in rows:
+            sku = row["sku"]
+            if sku in taken:
+                self.errors.append((number, f"sku '{sku}' is used by another account."))
+                continue
+            fields = {
+                "name": row["name"],
+                "category_id": self.categories.get(row["category"]),
+                "price": row["price"],
+                "description": row["description"],
+                "stock_alert_threshold": row["stock_alert_threshold"],
+            }
+            fields = {**updates.get(sku, {}), **{key: value for key, value in fields.items() if value not in ("", None)}}
+            if sku not in self.products and not {"name", "category_id", "price"} <= fields.keys():
+                self.errors.append((number, "name, category and price are required for a new product."))
+                continue
+            updates[sku] = fields
+            accepted.append((number, row))
+
+        updates = {sku: fields for sku, fields in updates.items() if fields}
+        if updates:
+            products = {
+                product.sku: product
+                for product in Product.objects.filter(company_owner=self.company_owner, sku__in=updates)
+            }
+            for sku, fields in updates.items():
+                product = products.setdefault(sku, Product(company_owner=self.company_owner, sku=sku))
+                for field, value in fields.items():
+                    setattr(product, field, value)
+
+            saved = Product.objects.bulk_create(
+                list(products.values()),
+                update_conflicts=True,
+                unique_fields=['sku'],
+                update_fields=['name', 'category', 'price', 'description', 'stock_alert_threshold'],
+            )
+            for product in saved:
+                self.products[product.sku] = product.pk
+            self.counts["products"] += len(saved)
+        return accepted
+
+    def save_variations(self, rows):
+        """
+        Upserts the chunk's variations on their sku; a later row of the same sku wins. A variation
+        stays with its product: rows giving its sku under another product are rejected.
+        """
+        new_skus = {
+            row["variation_sku"] for _, row in rows
+            if row["variation_sku"] and row["variation_sku"] not in self.variations
+        }
+        taken = set(ProductVariation.objects.filter(sku__in=new_skus).values_list('sku', flat=True))
+
+        variations = {}
+        accepted = []
+        for number, row in rows:
+            sku = row["variation_sku"]
+            if sku in taken:
+                self.errors.append((number, f"variation_sku '{sku}' is used by another account."))
+                continue
+            if sku:
+                product_id = self.products[row["sku"]]
+                _, current_product_id = self.variations.get(sku, (None, product_id))
+                if sku in variations:
+                    current_product_id = variations[sku].product_id
+                if current_product_id != product_id:
+                    self.errors.append((number, f"variation_sku '{sku}' belongs to another product."))
+                    continue
+                variations[sku] = ProductVariation(
+                    product_id=product_id,
+                    sku=sku,
+                    name=row["variation_name"],
+                    price=row["variation_price"],
+                )
+            accepted.append((number, row))
+
+        if variations:
+            saved = ProductVariation.objects.bulk_create(
+                list(variations.values()),
+                update_conflicts=True,
+                unique_fields=['sku'],
+                update_fields=['name', 'price'],
+            )
+            for variation in saved:
+                self.variations[variation.sku] = (variation.pk, variation.product_id)
+            self.counts["variations"] += len(saved)
+        return accepted
+
+    def save_stock(self, rows):
+        """
+        Links every imported batch to its product and books the chunk's quantities as one goods
+        receipt per warehouse.
+        """
+        lines_by_warehouse = defaultdict(list)
+        links = set()
+        for _, row in rows:
+            if not row["batch_number"]:
+                continue
+            product_id = self.products[row["sku"]]
+            batch_id = self.batches[row["batch_number"]]
+            links.add((product_id, batch_id))
+            if row["quantity"] is not None:
+                variation_id = self.variations[row["variation_sku"]][0] if row["variation_sku"] else None
+                lines_by_warehouse[row["warehouse"]].append(
+                    ReceiptLine(product_id, variation_id, batch_id, row["quantity"])
+                )
+
+        Product.batches.through.objects.bulk_create(
+            [Product.batches.through(product_id=product_id, batch_id=batch_id) for product_id, batch_id in links],
+            ignore_conflicts=True,
+        )
+        for name, lines in lines_by_warehouse.items():
+            warehouse = Warehouse(pk=self.warehouses[name], company_owner=self.company_owner, name=name)
+            self.counts["inventory rows"] += receive_stock(self.company_owner, warehouse, lines, reason=self.reason)
+
+
+def import_catalogue(company_owner, file, filename, chunk_size=None):
+    """
+    Imports a CSV or XLSX catalogue (see IMPORT_COLUMNS) for `company_owner`. Returns the
+    summary counts with an "errors" list of (row number, message).
+    """
+    importer = CatalogueImporter(company_owner, reason=f"Imported from {filename}", chunk_size=chunk_size)
+    return importer.run(iter_rows(file, filename))
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Min, Sum
+
+from stock_track.models import Inventory, InventoryLog, InventorySnapshot, StockThresholdEvent
+from stock_track.stock_levels import rebuild_stock_levels
+
+
+class Command(BaseCommand):
+    help = (
+        "Merge duplicate Inventory rows (same product, variation, batch and warehouse) into the oldest "
+        "one. Run it before adding the unique_inventory_item constraint to an existing database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report the duplicates.")
+
+    def handle(self, *args, **options):
+        duplicates = list(
+            Inventory.objects.values('product_id', 'product_variation_id', 'batch_id', 'warehouse_id')
+            .annotate(rows=Count('id'), keep_id=Min('id'), total=Sum('quantity'), company_owner_id=Min('company_owner_id'))
+            .filter(rows__gt=1)
+            .order_by()
+        )
+        if options['dry_run']:
+            extra = sum(group['rows'] - 1 for group in duplicates)
+            self.stdout.write(f"{len(duplicates)} duplicated item(s), {extra} extra row(s) would be merged.")
+            return
+
+        merged = 0
+        with transaction.atomic():
+            for group in duplicates:
+                rows = Inventory.objects.filter(
+                    product_id=group['product_id'],
+                    product_variation_id=group['product_variation_id'],
+                    batch_id=group['batch_id'],
+                    warehouse_id=group['warehouse_id'],
+                )
+                extra_ids = list(rows.exclude(id=group['keep_id']).values_list('id', flat=True))
+
+                # Keep the history: move the logs, threshold events and snapshots over to the surviving row
+                InventoryLog.objects.filter(inventory_id__in=extra_ids).update(inventory_id=group['keep_id'])
+                StockThresholdEvent.objects.filter(inventory_id__in=extra_ids).update(inventory_id=group['keep_id'])
+                # Snapshots are read one row per inventory and run, so each run's rows are summed into one
+                snapshots = InventorySnapshot.objects.filter(inventory_id__in=[group['keep_id'], *extra_ids])
+                snapshot_totals = list(
+                    snapshots.values('company_owner_id', 'taken_at').annotate(total=Sum('quantity')).order_by()
+                )
+                snapshots.delete()
+                InventorySnapshot.objects.bulk_create([
+                    InventorySnapshot(
+                        company_owner_id=row['company_owner_id'],
+                        inventory_id=group['keep_id'],
+                        quantity=row['total'],
+                        taken_at=row['taken_at'],
+                    )
+                    for row in snapshot_totals if row['total']
+                ])
+                Inventory.objects.filter(id=group['keep_id']).update(quantity=group['total'])
+                Inventory.objects.filter(id__in=extra_ids).delete()
+                merged += len(extra_ids)
+
+            # The quantities were moved with plain updates, so recompute the owners' stock levels
+            for owner_id in {group['company_owner_id'] for group in duplicates}:
+                rebuild_stock_levels(owner_id)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Merged {merged} duplicate inventory row(s) into {len(duplicates)} item(s)."
+        ))
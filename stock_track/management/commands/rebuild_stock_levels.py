@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from profiles.models import CustomUser
+from stock_track.stock_levels import rebuild_stock_levels
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the StockLevel and ProductStockLevel summary tables from Inventory. migrate fills "
+        "them once when they are empty; run this to repair them after writes that bypassed them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--owner", type=int, help="Only rebuild this company owner's stock levels.")
+
+    def handle(self, *args, **options):
+        if options['owner']:
+            owner_ids = [options['owner']]
+        else:
+            owner_ids = list(CustomUser.objects.filter(inventories__isnull=False).values_list('id', flat=True).distinct())
+            # Owners whose inventory is gone may still have stale summary rows
+            owner_ids += list(
+                CustomUser.objects.filter(stock_levels__isnull=False).exclude(id__in=owner_ids)
+                .values_list('id', flat=True).distinct()
+            )
+
+        # One transaction per owner keeps the locks short on large installs
+        for owner_id in owner_ids:
+            rebuild_stock_levels(owner_id)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stock levels for {len(owner_ids)} owner(s)."))
@@ -1,8 +1,6 @@
 from django.db import models
 from django.utils import timezone
 from django.conf import settings
-from django.core.mail import send_mail
-from concurrent.futures import ThreadPoolExecutor
 
 '''
 I'll ask the free trial users owner about
@@ -17,6 +15,15 @@ This simplifies stock management but requires manual oversight to avoid stockout
 
 '''
 
+class CurrentTransactionId(models.Func):
+    """
+    Id of the inserting transaction, as the database default of a change feed's `txid` column
+    (see stock_track.change_feed).
+    """
+    template = "pg_current_xact_id()::text::bigint"
+    output_field = models.BigIntegerField()
+
+
 class Warehouse(models.Model):
     company_owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -56,9 +63,10 @@ class Batch(models.Model):
     )
     batch_number = models.CharField(max_length=50, unique=True)
     manufacture_date = models.DateField(blank=True, null=True)
-    expiry_date = models.DateField(blank=True, null=True)
+    expiry_date = models.DateField(blank=True, null=True, db_index=True)
     supplier = models.ForeignKey(Supplier, on_delete=models.SET_NULL, blank=True, null=True, related_name="batches",
                                   help_text="Leave empty if there is no supplier and the product is your own.")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return f"Batch {self.batch_number}"
@@ -138,46 +146,243 @@ class Inventory(models.Model):
     warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name="inventory")
     quantity = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # Changed to DecimalField
     added_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    txid = models.BigIntegerField(db_default=CurrentTransactionId(), editable=False)
+
+    def __str__(self):
+        return f"{self.product.name} - Batch: {self.batch.batch_number} (Qty: {self.quantity})"
+
+    class Meta:
+        verbose_name_plural = "Inventories"
+        constraints = [
+            # One row per product/variation, batch and warehouse; receipts add to it (see receive_stock)
+            models.UniqueConstraint(
+                fields=['product', 'product_variation', 'batch', 'warehouse'],
+                nulls_distinct=False,
+                name='unique_inventory_item',
+            ),
+        ]
+        indexes = [
+            # Keyset pagination of the inventory list, unfiltered and by warehouse or product
+            models.Index(fields=['company_owner', '-id'], name='inventory_owner_id'),
+            models.Index(fields=['company_owner', 'warehouse', '-id'], name='inventory_owner_warehouse'),
+            models.Index(fields=['company_owner', 'product', '-id'], name='inventory_owner_product'),
+            models.Index(fields=['txid', 'id'], name='inventory_change_feed'),
+        ]
+
+
+class StockLevel(models.Model):
+    """
+    Quantity on hand per (owner, product, variation, warehouse), summed over batches.
+    Maintained in the same transaction as every Inventory change (see stock_track.stock_levels)
+    and rebuildable with the rebuild_stock_levels command.
+    """
+    company_owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="stock_levels",
+        verbose_name="Owner"
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="stock_levels")
+    product_variation = models.ForeignKey(
+        ProductVariation, on_delete=models.CASCADE, related_name="stock_levels", null=True, blank=True
+    )
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name="stock_levels")
+    quantity = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def __str__(self):
+        return f"{self.product.name} in {self.warehouse.name}: {self.quantity}"
+
     class Meta:
-        unique_together = ('product_variation', 'batch', 'warehouse')  # Prevent duplicate records per warehouse
+        constraints = [
+            models.UniqueConstraint(
+                fields=['company_owner', 'product', 'product_variation', 'warehouse'],
+                nulls_distinct=False,
+                name='unique_stock_level',
+            ),
+        ]
+
+
+class ProductStockLevel(models.Model):
+    """
+    Quantity on hand per (owner, product) over all variations, batches and warehouses.
+    Maintained together with StockLevel.
+    """
+    company_owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="product_stock_levels",
+        verbose_name="Owner"
+    )
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="product_stock_levels")
+    quantity = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"{self.product_variation.product.name} - Batch: {self.batch.batch_number} (Qty: {self.quantity})"
+        return f"{self.product.name}: {self.quantity}"
 
     class Meta:
-        verbose_name_plural = "Inventories"
+        constraints = [
+            models.UniqueConstraint(fields=['company_owner', 'product'], name='unique_product_stock_level'),
+        ]
+
+
+class StockTransfer(models.Model):
+    company_owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="stock_transfers",
+        verbose_name="Owner"
+    )
+    from_warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name="outgoing_transfers")
+    to_warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name="incoming_transfers")
+    note = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Transfer from {self.from_warehouse} to {self.to_warehouse} on {self.created_at:%Y-%m-%d}"
 
 
 class InventoryLog(models.Model):
+    LOG_TYPES = [
+        ("adjustment", "Adjustment"),
+        ("sale", "Sale"),
+        ("receipt", "Receipt"),
+        ("transfer_out", "Transfer Out"),
+        ("transfer_in", "Transfer In"),
+    ]
     inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name="logs")
     change_quantity = models.DecimalField(max_digits=10, decimal_places=2)
     reason = models.TextField(blank=True, null=True)
+    log_type = models.CharField(max_length=20, choices=LOG_TYPES, default="adjustment")
+    transfer = models.ForeignKey(
+        StockTransfer, on_delete=models.CASCADE, related_name="logs", blank=True, null=True
+    )
+    counterpart_warehouse = models.ForeignKey(
+        Warehouse, on_delete=models.SET_NULL, related_name="counterpart_logs", blank=True, null=True,
+        help_text="For transfers: the warehouse the stock came from or went to."
+    )
     created_at = models.DateTimeField(auto_now_add=True)
+    txid = models.BigIntegerField(db_default=CurrentTransactionId(), editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['log_type', 'txid', 'id'], name='inventory_log_type'),
+            # Log deltas after a snapshot, for point-in-time balances
+            models.Index(fields=['created_at'], name='inventory_log_created'),
+        ]
 
     def __str__(self):
         return f"Log for {self.inventory.product} - Change: {self.change_quantity}"
 
 
 
-def send_email_notification(company_owner, email_subject, email_body):
+class InventorySnapshot(models.Model):
     """
-    Sends an email notification to the company owner.
+    Quantity of one inventory row at the time of a snapshot run. Rows holding nothing are not
+    stored. The balance at any other time is the nearest run plus the InventoryLog changes
+    between the two (see stock_track.snapshots).
     """
-    send_mail(
-        subject = email_subject,
-        message = email_body,
-        from_email = settings.EMAIL_HOST_USER,
-        recipient_list = [company_owner.email],
-        fail_silently = False,
+    company_owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="inventory_snapshots",
+        verbose_name="Owner"
     )
+    inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name="snapshots")
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    taken_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.inventory_id} at {self.taken_at}: {self.quantity}"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company_owner', 'taken_at'], name='inventory_snapshot_owner'),
+            models.Index(fields=['taken_at'], name='inventory_snapshot_taken'),
+        ]
+
+
+class AlertState(models.Model):
+    """
+    Last known state of one alert condition, so alerts are only sent when the condition is
+    newly raised instead of on every run. The fingerprint identifies the condition:
+    alert type, object and the threshold it was evaluated against.
+    """
+    ALERT_TYPES = [
+        ("batch_expiring", "Batch Expiring"),
+        ("batch_expired", "Batch Expired"),
+        ("low_stock", "Low Stock"),
+        ("out_of_stock", "Out of Stock"),
+    ]
+    company_owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="alert_states",
+        verbose_name="Owner"
+    )
+    fingerprint = models.CharField(max_length=150, unique=True)
+    alert_type = models.CharField(max_length=30, choices=ALERT_TYPES)
+    object_id = models.PositiveBigIntegerField()
+    threshold = models.CharField(max_length=50, blank=True)
+    is_active = models.BooleanField(default=True)
+    raised_at = models.DateTimeField()
+    cleared_at = models.DateTimeField(blank=True, null=True)
 
-executor = ThreadPoolExecutor(max_workers=5)
+    def __str__(self):
+        return f"{self.fingerprint} ({'active' if self.is_active else 'cleared'})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['alert_type', 'object_id'], name='alert_state_object'),
+        ]
 
-def send_email_in_background(company_owner, email_subject, email_body):
+
+class ChangeCursor(models.Model):
     """
-    Schedule the email notification to run in the background.
+    Durable progress marker of a periodic consumer (e.g. an alert run): the last processed
+    row (by inserting transaction id, then row id) and/or the time up to which changes have
+    been evaluated.
     """
-    executor.submit(send_email_notification, company_owner, email_subject, email_body)
+    name = models.CharField(max_length=100, unique=True)
+    last_txid = models.PositiveBigIntegerField(default=0)
+    last_id = models.PositiveBigIntegerField(default=0)
+    last_seen_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
+    def __str__(self):
+        return f"{self.name} (id {self.last_id}, {self.last_seen_at})"
+
+
+class StockThresholdEvent(models.Model):
+    """
+    Append-only queue of stock level changes, written by the inventory mutation paths when
+    a row crosses its product's stock_alert_threshold (or runs out, or is restocked).
+    The notifier drains it through a change feed cursor.
+    """
+    LEVELS = [
+        ("in_stock", "In Stock"),
+        ("low_stock", "Low Stock"),
+        ("out_of_stock", "Out of Stock"),
+    ]
+    company_owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="stock_threshold_events",
+        verbose_name="Owner"
+    )
+    inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name="threshold_events")
+    level = models.CharField(max_length=20, choices=LEVELS, help_text="Stock level the row crossed into.")
+    quantity = models.DecimalField(max_digits=10, decimal_places=2)
+    threshold = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    txid = models.BigIntegerField(db_default=CurrentTransactionId(), editable=False)
+
+    def __str__(self):
+        return f"{self.inventory_id} crossed into {self.level} ({self.quantity}/{self.threshold})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['txid', 'id'], name='threshold_event_change_feed'),
+        ]
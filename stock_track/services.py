@@ -0,0 +1,391 @@
+from collections import defaultdict
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .alerts import record_threshold_crossings
+from .models import Batch, Inventory, InventoryLog, Product, ProductVariation, StockTransfer
+from .stock_levels import apply_stock_deltas, stock_key, unsellable_stock
+
+
+class InsufficientStockError(ValueError):
+    """
+    Raised when the stock on hand does not cover a requested allocation.
+    """
+
+
+class StockDemand(NamedTuple):
+    """
+    A quantity of one product (or product variation) that has to be taken out of stock.
+    """
+    product_id: int
+    product_variation_id: int | None
+    quantity: object
+    reason: str | None = None
+
+
+class ReceiptLine(NamedTuple):
+    """
+    A quantity of one product (or product variation) from one batch that arrived at a warehouse.
+    """
+    product_id: int
+    product_variation_id: int | None
+    batch_id: int
+    quantity: object
+
+
+# Candidate inventory rows are consumed in this order
+ALLOCATION_ORDERINGS = {
+    # First Expired, First Out: batches without an expiry date go last
+    "fefo": (
+        F('batch__expiry_date').asc(nulls_last=True),
+        F('batch__manufacture_date').asc(nulls_last=True),
+        'id',
+    ),
+    # First In, First Out: oldest manufactured batch first
+    "fifo": (
+        F('batch__manufacture_date').asc(nulls_last=True),
+        'id',
+    ),
+}
+
+
+def allocate_stock(company_owner, demands, strategy=None):
+    """
+    Takes every demand out of the owner's stock, splitting each one across as many batches
+    and warehouses as needed, ordered by the FEFO or FIFO `strategy`. Expired batches are
+    skipped unless SELL_EXPIRED_STOCK is set.
+
+    All candidate rows are fetched (and locked) in one ordered query, and the decrements and
+    InventoryLog rows are written in bulk. Nothing is written if any demand can't be met.
+    Returns a list of (inventory, quantity_taken) pairs.
+    """
+    strategy = strategy or settings.STOCK_ALLOCATION_STRATEGY
+    if strategy not in ALLOCATION_ORDERINGS:
+        raise ValueError(f"Unknown stock allocation strategy: {strategy}")
+
+    demands = [demand for demand in demands if demand.quantity > 0]
+    if not demands:
+        return []
+
+    with transaction.atomic():
+        # 1. Lock every candidate row in a single ordered query
+        candidates = (
+            Inventory.objects.select_for_update(of=('self',))
+            .select_related('batch', 'product')
+            .filter(
+                company_owner=company_owner,
+                product_id__in={demand.product_id for demand in demands},
+                quantity__gt=0,
+            )
+            .order_by(*ALLOCATION_ORDERINGS[strategy])
+        )
+        unsellable = unsellable_stock()
+        if unsellable is not None:
+            candidates = candidates.exclude(unsellable)
+        rows_by_item = defaultdict(list)
+        for inventory in candidates:
+            rows_by_item[(inventory.product_id, inventory.product_variation_id)].append(inventory)
+
+        # 2. Split the demands across the candidate rows in memory
+        allocations = []
+        previous_quantities = {}
+        for demand in demands:
+            remaining = demand.quantity
+            for inventory in rows_by_item[(demand.product_id, demand.product_variation_id)]:
+                if remaining <= 0:
+                    break
+                taken = min(inventory.quantity, remaining)
+                if taken <= 0:
+                    continue
+                previous_quantities.setdefault(inventory.pk, inventory.quantity)
+                inventory.quantity -= taken
+                remaining -= taken
+                allocations.append((inventory, taken, demand.reason))
+
+            if remaining > 0:
+                product = Product.objects.filter(pk=demand.product_id).values_list('name', flat=True).first()
+                raise InsufficientStockError(
+                    f"Insufficient inventory for {product} to complete the sale"
+                )
+
+        # 3. Write the decrements and the log rows in bulk
+        touched = {inventory.pk: inventory for inventory, _, _ in allocations}
+        now_time = timezone.now()
+        for inventory in touched.values():
+            inventory.updated_at = now_time
+        Inventory.objects.bulk_update(touched.values(), ['quantity', 'updated_at'])
+        InventoryLog.objects.bulk_create([
+            InventoryLog(inventory=inventory, change_quantity=-taken, reason=reason, log_type="sale")
+            for inventory, taken, reason in allocations
+        ])
+        record_threshold_crossings([
+            (inventory, previous_quantities[inventory.pk], inventory.product.stock_alert_threshold)
+            for inventory in touched.values()
+        ])
+
+        stock_deltas = defaultdict(lambda: 0)
+        for inventory, taken, _ in allocations:
+            stock_deltas[stock_key(inventory)] -= taken
+        apply_stock_deltas(stock_deltas)
+
+        _unlink_depleted_batches(touched.values())
+
+    return [(inventory, taken) for inventory, taken, _ in allocations]
+
+
+def _unlink_depleted_batches(inventories):
+    """
+    Removes a product from a batch once none of that batch's inventory rows hold any of it.
+    """
+    batch_ids = {inventory.batch_id for inventory in inventories}
+    product_ids = {inventory.product_id for inventory in inventories}
+    depleted = (
+        Inventory.objects.filter(batch_id__in=batch_ids, product_id__in=product_ids)
+        .values('batch_id', 'product_id')
+        .annotate(total=Sum('quantity'))
+        .filter(total__lte=0)
+    )
+
+    condition = Q()
+    for row in depleted:
+        condition |= Q(batch_id=row['batch_id'], product_id=row['product_id'])
+    if condition:
+        Product.batches.through.objects.filter(condition).delete()
+
+
+def transfer_stock(company_owner, from_warehouse, to_warehouse, lines, note=None):
+    """
+    Moves stock between two of the owner's warehouses in one transaction.
+
+    `lines` is a list of (inventory_id, quantity) taken from rows of `from_warehouse`; each
+    quantity is added to the matching product/variation/batch row of `to_warehouse` (created
+    if missing). Every line writes a transfer_out/transfer_in pair of InventoryLog rows that
+    point at the StockTransfer and at the counterpart warehouse. Returns the StockTransfer.
+    """
+    if from_warehouse.pk == to_warehouse.pk:
+        raise ValueError("Choose two different warehouses for a transfer.")
+    if company_owner.pk != from_warehouse.company_owner_id or company_owner.pk != to_warehouse.company_owner_id:
+        raise ValueError("Both warehouses must belong to you.")
+
+    quantities = defaultdict(lambda: 0)
+    for inventory_id, quantity in lines:
+        if quantity <= 0:
+            raise ValueError("Transfer quantities must be greater than zero.")
+        quantities[int(inventory_id)] += quantity
+    if not quantities:
+        raise ValueError("A transfer needs at least one line.")
+
+    with transaction.atomic():
+        sources = {
+            inventory.pk: inventory
+            for inventory in Inventory.objects.select_for_update(of=('self',)).select_related('product').filter(
+                pk__in=quantities, company_owner=company_owner, warehouse=from_warehouse
+            )
+        }
+        missing = set(quantities) - set(sources)
+        if missing:
+            raise ValueError(f"Inventory rows {sorted(missing)} are not in {from_warehouse.name}.")
+        for inventory_id, quantity in quantities.items():
+            if sources[inventory_id].quantity < quantity:
+                raise InsufficientStockError(
+                    f"Insufficient inventory for {sources[inventory_id].product.name} in {from_warehouse.name}"
+                )
+
+        # Matching destination rows, one locking query; rows that don't exist yet are created empty
+        def item_key(inventory):
+            return (inventory.product_id, inventory.product_variation_id, inventory.batch_id)
+
+        destinations = {}
+        for inventory in Inventory.objects.select_for_update().filter(
+            company_owner=company_owner,
+            warehouse=to_warehouse,
+            product_id__in={source.product_id for source in sources.values()},
+            batch_id__in={source.batch_id for source in sources.values()},
+        ).order_by('id'):
+            destinations.setdefault(item_key(inventory), inventory)
+        new_rows = []
+        for source in sources.values():
+            if item_key(source) not in destinations:
+                destination = Inventory(
+                    company_owner=company_owner,
+                    product_id=source.product_id,
+                    product_variation_id=source.product_variation_id,
+                    batch_id=source.batch_id,
+                    warehouse=to_warehouse,
+                    quantity=0,
+                )
+                destinations[item_key(source)] = destination
+                new_rows.append(destination)
+        Inventory.objects.bulk_create(new_rows)
+        new_ids = {row.pk for row in new_rows}
+
+        transfer = StockTransfer.objects.create(
+            company_owner=company_owner, from_warehouse=from_warehouse, to_warehouse=to_warehouse, note=note
+        )
+
+        logs = []
+        touched = {}
+        previous_quantities = {}
+        thresholds = {}
+        now_time = timezone.now()
+        for inventory_id, quantity in quantities.items():
+            source = sources[inventory_id]
+            destination = destinations[item_key(source)]
+            touched[destination.pk] = destination
+            for inventory in (source, destination):
+                # Rows created for this transfer have no previous level
+                previous_quantities.setdefault(inventory.pk, None if inventory.pk in new_ids else inventory.quantity)
+                thresholds[inventory.pk] = source.product.stock_alert_threshold
+            source.quantity -= quantity
+            destination.quantity += quantity
+            source.updated_at = destination.updated_at = now_time
+            logs.append(InventoryLog(
+                inventory=source, change_quantity=-quantity, log_type="transfer_out", transfer=transfer,
+                counterpart_warehouse=to_warehouse, reason=f"Transferred to {to_warehouse.name}",
+            ))
+            logs.append(InventoryLog(
+                inventory=destination, change_quantity=quantity, log_type="transfer_in", transfer=transfer,
+                counterpart_warehouse=from_warehouse, reason=f"Transferred from {from_warehouse.name}",
+            ))
+
+        Inventory.objects.bulk_update(
+            list(sources.values()) + list(touched.values()), ['quantity', 'updated_at']
+        )
+        InventoryLog.objects.bulk_create(logs)
+
+        stock_deltas = defaultdict(lambda: 0)
+        for inventory_id, quantity in quantities.items():
+            source = sources[inventory_id]
+            stock_deltas[stock_key(source)] -= quantity
+            stock_deltas[stock_key(destinations[item_key(source)])] += quantity
+        apply_stock_deltas(stock_deltas)
+
+        record_threshold_crossings([
+            (inventory, previous_quantities[inventory.pk], thresholds[inventory.pk])
+            for inventory in list(sources.values()) + list(touched.values())
+        ])
+
+    return transfer
+
+
+def _receipt_sql(line_count):
+    """
+    One statement per chunk of receipt lines: upserts the inventory rows, adding to the quantity
+    of existing ones, writes their "receipt" log rows and returns
+    (inventory id, product, variation, batch, new quantity, received quantity, inserted) per line,
+    where inserted tells a row the statement created (xmax = 0) from one it added to.
+    """
+    inventory_table = Inventory._meta.db_table
+    log_table = InventoryLog._meta.db_table
+    values = ", ".join(["(%s::bigint, %s::bigint, %s::bigint, %s::numeric)"] * line_count)
+    return f"""
+        WITH lines (product_id, product_variation_id, batch_id, quantity) AS (VALUES {values}),
+        upserted AS (
+            INSERT INTO {inventory_table}
+                (company_owner_id, product_id, product_variation_id, batch_id, warehouse_id, quantity, added_at, updated_at)
+            SELECT %s, product_id, product_variation_id, batch_id, %s, quantity, %s, %s FROM lines
+            ON CONFLICT (product_id, product_variation_id, batch_id, warehouse_id)
+            DO UPDATE SET quantity = {inventory_table}.quantity + EXCLUDED.quantity, updated_at = EXCLUDED.updated_at
+            RETURNING id, product_id, product_variation_id, batch_id, quantity, (xmax = 0) AS inserted
+        ),
+        received AS (
+            SELECT upserted.*, lines.quantity AS received_quantity
+            FROM upserted JOIN lines
+                ON upserted.product_id = lines.product_id
+                AND upserted.product_variation_id IS NOT DISTINCT FROM lines.product_variation_id
+                AND upserted.batch_id = lines.batch_id
+        ),
+        logged AS (
+            INSERT INTO {log_table} (inventory_id, change_quantity, reason, log_type, created_at)
+            SELECT id, received_quantity, %s, 'receipt', %s FROM received
+        )
+        SELECT id, product_id, product_variation_id, batch_id, quantity, received_quantity, inserted FROM received
+    """
+
+
+def receive_stock(company_owner, warehouse, lines, reason=None, chunk_size=None):
+    """
+    Books a goods receipt into `warehouse`: each ReceiptLine's quantity is added to the matching
+    product/variation/batch row of the warehouse, which is created if missing.
+
+    Every chunk of RECEIPT_CHUNK_SIZE lines is a single INSERT ... ON CONFLICT DO UPDATE
+    SET quantity = quantity + excluded.quantity that also writes the InventoryLog rows, so a large
+    delivery takes one round trip per chunk plus a fixed number of statements for validation and
+    the stock summaries. Raises ValueError for lines the owner can't receive.
+    Returns the number of inventory rows received into.
+    """
+    if warehouse.company_owner_id != company_owner.pk:
+        raise ValueError("The warehouse must belong to you.")
+
+    quantities = defaultdict(lambda: 0)
+    for line in lines:
+        if line.quantity <= 0:
+            raise ValueError("Received quantities must be greater than zero.")
+        variation_id = int(line.product_variation_id) if line.product_variation_id else None
+        quantities[(int(line.product_id), variation_id, int(line.batch_id))] += line.quantity
+    if not quantities:
+        raise ValueError("A receipt needs at least one line.")
+
+    # Everything on the receipt must belong to the owner: one query per related model
+    thresholds = dict(
+        Product.objects.filter(company_owner=company_owner, pk__in={key[0] for key in quantities})
+        .values_list('id', 'stock_alert_threshold')
+    )
+    variations = dict(
+        ProductVariation.objects.filter(
+            product__company_owner=company_owner, pk__in={key[1] for key in quantities if key[1]}
+        ).values_list('id', 'product_id')
+    )
+    batch_ids = set(
+        Batch.objects.filter(company_owner=company_owner, pk__in={key[2] for key in quantities})
+        .values_list('id', flat=True)
+    )
+    errors = []
+    for product_id, variation_id, batch_id in quantities:
+        if product_id not in thresholds:
+            errors.append(f"Product {product_id} does not exist.")
+        elif variation_id is not None and variations.get(variation_id) != product_id:
+            errors.append(f"Variation {variation_id} does not exist for product {product_id}.")
+        if batch_id not in batch_ids:
+            errors.append(f"Batch {batch_id} does not exist.")
+    if errors:
+        raise ValueError(" ".join(dict.fromkeys(errors)))
+
+    chunk_size = chunk_size or settings.RECEIPT_CHUNK_SIZE
+    reason = reason or f"Received at {warehouse.name}"
+    # A fixed order, so concurrent receipts lock the inventory rows in the same order
+    items = sorted(quantities.items(), key=lambda item: (item[0][0], item[0][1] or 0, item[0][2]))
+    now_time = timezone.now()
+
+    received = []
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start + chunk_size]
+                params = [value for key, quantity in chunk for value in (*key, quantity)]
+                params += [company_owner.pk, warehouse.pk, now_time, now_time, reason, now_time]
+                cursor.execute(_receipt_sql(len(chunk)), params)
+                received.extend(cursor.fetchall())
+
+        # Stock summaries, threshold crossings and product/batch links, once per receipt
+        stock_deltas = defaultdict(lambda: 0)
+        changes = []
+        for inventory_id, product_id, variation_id, batch_id, quantity, received_quantity, inserted in received:
+            stock_deltas[(company_owner.pk, product_id, variation_id, warehouse.pk)] += received_quantity
+            inventory = Inventory(pk=inventory_id, company_owner_id=company_owner.pk, quantity=quantity)
+            changes.append((inventory, None if inserted else quantity - received_quantity, thresholds[product_id]))
+        apply_stock_deltas(stock_deltas)
+        record_threshold_crossings(changes)
+        Product.batches.through.objects.bulk_create(
+            [
+                Product.batches.through(product_id=product_id, batch_id=batch_id)
+                for product_id, batch_id in {(key[0], key[2]) for key in quantities}
+            ],
+            ignore_conflicts=True,
+        )
+
+    return len(received)
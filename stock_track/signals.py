@@ -0,0 +1,50 @@
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
+from django.dispatch import receiver
+from .models import Inventory, StockLevel
+from .stock_levels import apply_stock_deltas, rebuild_stock_levels, remove_stock, stock_key
+
+
+# Single-row saves (forms, admin) keep the stock summary tables in step here; the bulk paths
+# in stock_track.services update them directly.
+@receiver(pre_save, sender=Inventory)
+def remember_previous_stock(sender, instance, **kwargs):
+    """
+    Keep the stored key and quantity of an existing inventory row so the stock levels can be moved by a delta.
+    """
+    previous = None
+    if instance.pk:
+        previous = (
+            Inventory.objects.filter(pk=instance.pk)
+            .values('company_owner_id', 'product_id', 'product_variation_id', 'warehouse_id', 'quantity')
+            .first()
+        )
+    instance._previous_stock = previous
+
+
+@receiver(post_save, sender=Inventory)
+def update_stock_levels_on_save(sender, instance, **kwargs):
+    deltas = {stock_key(instance): instance.quantity}
+    previous = getattr(instance, '_previous_stock', None)
+    if previous:
+        key = stock_key(previous)
+        deltas[key] = deltas.get(key, 0) - previous['quantity']
+    apply_stock_deltas(deltas)
+
+
+@receiver(post_delete, sender=Inventory)
+def update_stock_levels_on_delete(sender, instance, **kwargs):
+    remove_stock(stock_key(instance), instance.quantity)
+
+
+@receiver(post_migrate)
+def backfill_stock_levels(sender, app_config=None, **kwargs):
+    """
+    Fills StockLevel and ProductStockLevel from Inventory after a migrate that finds them empty
+    while stock exists, i.e. on an install that had inventory before the summary tables were
+    added. Checkout reads its availability from StockLevel, so it would refuse every sale until
+    the tables are filled. Later drift is repaired with the rebuild_stock_levels command.
+    """
+    if app_config is None or app_config.label != 'stock_track':
+        return
+    if not StockLevel.objects.exists() and Inventory.objects.exclude(quantity=0).exists():
+        rebuild_stock_levels()
@@ -0,0 +1,114 @@
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max, Min, Sum
+from django.utils import timezone
+
+from .models import Inventory, InventoryLog, InventorySnapshot
+
+
+def snapshot_time():
+    """
+    The latest time a snapshot can be taken at: INVENTORY_SNAPSHOT_SETTLE_SECONDS before now, or
+    before the start of the oldest transaction still open, whichever is earlier. Every
+    InventoryLog row created up to then has committed, since its transaction started before.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT min(xact_start) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND pid <> pg_backend_pid() AND xact_start IS NOT NULL"
+        )
+        oldest_open = cursor.fetchone()[0]
+    settle = timedelta(seconds=settings.INVENTORY_SNAPSHOT_SETTLE_SECONDS)
+    now_time = timezone.now()
+    return min(now_time, oldest_open or now_time) - settle
+
+
+def take_inventory_snapshots(company_owner_id=None):
+    """
+    Records the quantity of every Inventory row at snapshot_time(), for one owner or for
+    everyone, leaving out rows that held nothing. Returns (taken_at, number of rows written).
+
+    Each quantity is derived from the ledger: the current quantity less the InventoryLog
+    changes created after taken_at, read in one INSERT ... SELECT so both come from the same
+    database snapshot. A change that hasn't committed yet is in neither, so a snapshot always
+    equals the ledger up to taken_at and inventory_balances_at() can add the logs after it.
+    """
+    taken_at = snapshot_time()
+    snapshot_table = InventorySnapshot._meta.db_table
+    inventory_table = Inventory._meta.db_table
+    log_table = InventoryLog._meta.db_table
+    owner_filter = "AND inventory.company_owner_id = %s" if company_owner_id is not None else ""
+    sql = f"""
+        INSERT INTO {snapshot_table} (company_owner_id, inventory_id, quantity, taken_at)
+        SELECT inventory.company_owner_id, inventory.id, inventory.quantity - COALESCE(later.change, 0), %s
+        FROM {inventory_table} AS inventory
+        LEFT JOIN (
+            SELECT inventory_id, SUM(change_quantity) AS change
+            FROM {log_table} WHERE created_at > %s GROUP BY inventory_id
+        ) AS later ON later.inventory_id = inventory.id
+        WHERE inventory.quantity - COALESCE(later.change, 0) <> 0 {owner_filter}
+    """
+    params = [taken_at, taken_at]
+    if company_owner_id is not None:
+        params.append(company_owner_id)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return taken_at, cursor.rowcount
+
+
+def snapshot_inventory(task=None):
+    """
+    Scheduled task: takes a snapshot run unless the last one is younger than
+    INVENTORY_SNAPSHOT_INTERVAL, so the task can be scheduled more often than the interval.
+    """
+    last_run = InventorySnapshot.objects.aggregate(last=Max('taken_at'))['last']
+    if last_run and timezone.now() - last_run < timedelta(seconds=settings.INVENTORY_SNAPSHOT_INTERVAL):
+        print(f"Last inventory snapshot taken at {last_run}, skipping.")
+        return
+
+    taken_at, rows = take_inventory_snapshots()
+    print(f"Inventory snapshot taken at {taken_at}: {rows} rows.")
+
+
+def inventory_balances_at(company_owner, at, inventories=None):
+    """
+    Quantity on hand of each of the owner's Inventory rows at `at`, as {inventory_id: quantity};
+    rows that held nothing are left out. `inventories` optionally narrows the Inventory queryset.
+
+    Starts from the latest snapshot run at or before `at` and adds the InventoryLog changes made
+    since, up to `at`. Before the first run it works back from the next run instead, or from the
+    live quantities when there is no run yet, subtracting the changes made after `at`. Either
+    way only the logs between `at` and the nearest snapshot are read.
+    """
+    inventories = inventories if inventories is not None else Inventory.objects.all()
+    inventories = inventories.filter(company_owner=company_owner)
+    snapshots = InventorySnapshot.objects.filter(company_owner=company_owner, inventory__in=inventories)
+    logs = InventoryLog.objects.filter(inventory__in=inventories)
+
+    before = InventorySnapshot.objects.filter(company_owner=company_owner, taken_at__lte=at).aggregate(
+        taken_at=Max('taken_at')
+    )['taken_at']
+    if before is not None:
+        base = snapshots.filter(taken_at=before).values_list('inventory_id', 'quantity')
+        logs, sign = logs.filter(created_at__gt=before, created_at__lte=at), 1
+    else:
+        after = InventorySnapshot.objects.filter(company_owner=company_owner, taken_at__gt=at).aggregate(
+            taken_at=Min('taken_at')
+        )['taken_at']
+        if after is not None:
+            base = snapshots.filter(taken_at=after).values_list('inventory_id', 'quantity')
+            logs = logs.filter(created_at__gt=at, created_at__lte=after)
+        else:
+            base = inventories.exclude(quantity=0).values_list('id', 'quantity')
+            logs = logs.filter(created_at__gt=at)
+        sign = -1
+
+    balances = defaultdict(Decimal, base)
+    for inventory_id, change in logs.values_list('inventory_id').annotate(change=Sum('change_quantity')).order_by():
+        balances[inventory_id] += sign * change
+    return {inventory_id: quantity for inventory_id, quantity in balances.items() if quantity}
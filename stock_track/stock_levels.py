@@ -0,0 +1,172 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import Inventory, ProductStockLevel, StockLevel
+
+
+def stock_key(inventory):
+    """
+    The StockLevel an Inventory row (instance or values() dict) counts towards:
+    (company_owner_id, product_id, product_variation_id, warehouse_id).
+    """
+    if isinstance(inventory, dict):
+        return (
+            inventory['company_owner_id'], inventory['product_id'],
+            inventory['product_variation_id'], inventory['warehouse_id'],
+        )
+    return (
+        inventory.company_owner_id, inventory.product_id,
+        inventory.product_variation_id, inventory.warehouse_id,
+    )
+
+
+def _sorted_rows(deltas):
+    # A fixed order, so concurrent writers lock the summary rows in the same order
+    return sorted(deltas.items(), key=lambda item: tuple(-1 if part is None else part for part in item[0]))
+
+
+def apply_stock_deltas(deltas):
+    """
+    Adds `deltas` ({stock_key: quantity change}) to StockLevel and ProductStockLevel, creating
+    missing rows. Each table takes one INSERT ... ON CONFLICT DO UPDATE SET quantity = quantity + x,
+    so concurrent writers never lose each other's changes. Call it in the transaction of the
+    Inventory change it mirrors.
+    """
+    deltas = {key: Decimal(delta) for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    product_deltas = defaultdict(Decimal)
+    for (owner_id, product_id, _, _), delta in deltas.items():
+        product_deltas[(owner_id, product_id)] += delta
+    product_deltas = {key: delta for key, delta in product_deltas.items() if delta}
+
+    now_time = timezone.now()
+    stock_rows = _sorted_rows(deltas)
+    product_rows = _sorted_rows(product_deltas)
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        table = StockLevel._meta.db_table
+        cursor.execute(
+            f"INSERT INTO {table} (company_owner_id, product_id, product_variation_id, warehouse_id, quantity, updated_at) "
+            f"VALUES {', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(stock_rows))} "
+            f"ON CONFLICT (company_owner_id, product_id, product_variation_id, warehouse_id) "
+            f"DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity, updated_at = EXCLUDED.updated_at",
+            [value for key, delta in stock_rows for value in (*key, delta, now_time)],
+        )
+        if product_rows:
+            table = ProductStockLevel._meta.db_table
+            cursor.execute(
+                f"INSERT INTO {table} (company_owner_id, product_id, quantity, updated_at) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s)'] * len(product_rows))} "
+                f"ON CONFLICT (company_owner_id, product_id) "
+                f"DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity, updated_at = EXCLUDED.updated_at",
+                [value for key, delta in product_rows for value in (*key, delta, now_time)],
+            )
+
+
+def remove_stock(key, quantity):
+    """
+    Takes a deleted Inventory row's quantity off its existing summary rows. Unlike
+    apply_stock_deltas it never creates rows, since the product or warehouse may be on its
+    way out in the same cascade.
+    """
+    owner_id, product_id, variation_id, warehouse_id = key
+    now_time = timezone.now()
+    StockLevel.objects.filter(
+        company_owner_id=owner_id, product_id=product_id,
+        product_variation_id=variation_id, warehouse_id=warehouse_id,
+    ).update(quantity=F('quantity') - quantity, updated_at=now_time)
+    ProductStockLevel.objects.filter(company_owner_id=owner_id, product_id=product_id).update(
+        quantity=F('quantity') - quantity, updated_at=now_time
+    )
+
+
+def unsellable_stock():
+    """
+    Filter for the Inventory rows sales can't take from: those of expired batches, unless
+    SELL_EXPIRED_STOCK allows selling them. None when every row is sellable.
+    """
+    if settings.SELL_EXPIRED_STOCK:
+        return None
+    return Q(batch__expiry_date__lt=timezone.now().date())
+
+
+def available_quantities(company_owner, items):
+    """
+    Sellable quantity of each (product_id, product_variation_id) in `items` across all warehouses:
+    the StockLevel totals, less what is held in expired batches (see unsellable_stock()). Takes
+    one query on StockLevel and one on the expired Inventory rows of these products.
+    """
+    items = set(items)
+    product_ids = {product_id for product_id, _ in items}
+    available = defaultdict(Decimal)
+    rows = (
+        StockLevel.objects.filter(company_owner=company_owner, product_id__in=product_ids)
+        .values_list('product_id', 'product_variation_id')
+        .annotate(total=Sum('quantity'))
+    )
+    for product_id, variation_id, total in rows:
+        if (product_id, variation_id) in items:
+            available[(product_id, variation_id)] = total
+
+    unsellable = unsellable_stock()
+    if unsellable is not None:
+        rows = (
+            Inventory.objects.filter(unsellable, company_owner=company_owner, product_id__in=product_ids, quantity__gt=0)
+            .values_list('product_id', 'product_variation_id')
+            .annotate(total=Sum('quantity'))
+            .order_by()
+        )
+        for product_id, variation_id, total in rows:
+            if (product_id, variation_id) in items:
+                available[(product_id, variation_id)] -= total
+    return available
+
+
+def rebuild_stock_levels(company_owner_id=None):
+    """
+    Recomputes StockLevel and ProductStockLevel from Inventory, for one owner or for everyone.
+    """
+    inventories = Inventory.objects.all()
+    stock_levels = StockLevel.objects.all()
+    product_stock_levels = ProductStockLevel.objects.all()
+    if company_owner_id is not None:
+        inventories = inventories.filter(company_owner_id=company_owner_id)
+        stock_levels = stock_levels.filter(company_owner_id=company_owner_id)
+        product_stock_levels = product_stock_levels.filter(company_owner_id=company_owner_id)
+
+    with transaction.atomic():
+        stock_levels.delete()
+        product_stock_levels.delete()
+        StockLevel.objects.bulk_create(
+            [
+                StockLevel(
+                    company_owner_id=row['company_owner_id'],
+                    product_id=row['product_id'],
+                    product_variation_id=row['product_variation_id'],
+                    warehouse_id=row['warehouse_id'],
+                    quantity=row['total'],
+                )
+                for row in inventories.values(
+                    'company_owner_id', 'product_id', 'product_variation_id', 'warehouse_id'
+                ).annotate(total=Sum('quantity')).order_by()
+            ],
+            batch_size=1000,
+        )
+        ProductStockLevel.objects.bulk_create(
+            [
+                ProductStockLevel(
+                    company_owner_id=row['company_owner_id'],
+                    product_id=row['product_id'],
+                    quantity=row['total'],
+                )
+                for row in inventories.values('company_owner_id', 'product_id').annotate(total=Sum('quantity')).order_by()
+            ],
+            batch_size=1000,
+        )
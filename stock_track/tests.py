@@ -1,3 +1,169 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from profiles.models import CustomUser
+from .change_feed import consume_changes
+from .models import Batch, Category, Inventory, InventoryLog, Product, StockLevel, StockThresholdEvent, Warehouse
+from .services import InsufficientStockError, ReceiptLine, StockDemand, allocate_stock, receive_stock
+
+
+class StockTestData:
+    """
+    An owner with one product held in two batches of one warehouse: 5 units expiring in
+    10 days and 10 units expiring in 30 days.
+    """
+
+    def create_stock(self):
+        self.owner = CustomUser.objects.create_user(username="owner", password="secret")
+        category = Category.objects.create(company_owner=self.owner, name="Category")
+        self.product = Product.objects.create(
+            company_owner=self.owner, name="Product", category=category, sku="SKU-1",
+            price=Decimal("1.00"), stock_alert_threshold=2,
+        )
+        self.warehouse = Warehouse.objects.create(company_owner=self.owner, name="Warehouse")
+        today = timezone.now().date()
+        self.early = Batch.objects.create(
+            company_owner=self.owner, batch_number="EARLY", expiry_date=today + timedelta(days=10)
+        )
+        self.late = Batch.objects.create(
+            company_owner=self.owner, batch_number="LATE", expiry_date=today + timedelta(days=30)
+        )
+        receive_stock(self.owner, self.warehouse, [
+            ReceiptLine(self.product.pk, None, self.early.pk, Decimal("5")),
+            ReceiptLine(self.product.pk, None, self.late.pk, Decimal("10")),
+        ])
+
+    def quantity(self, batch):
+        return Inventory.objects.get(product=self.product, batch=batch).quantity
+
+    def demand(self, quantity):
+        return StockDemand(self.product.pk, None, Decimal(quantity), "Test sale")
+
+
+class ReceiveStockTests(StockTestData, TestCase):
+    def setUp(self):
+        self.create_stock()
+
+    def test_new_rows_record_no_threshold_events(self):
+        self.assertFalse(StockThresholdEvent.objects.exists())
+
+    def test_receiving_adds_to_the_existing_row(self):
+        receive_stock(self.owner, self.warehouse, [ReceiptLine(self.product.pk, None, self.early.pk, Decimal("3"))])
+
+        self.assertEqual(self.quantity(self.early), Decimal("8"))
+        self.assertEqual(StockLevel.objects.get(product=self.product).quantity, Decimal("18"))
+
+
+class AllocateStockTests(StockTestData, TestCase):
+    def setUp(self):
+        self.create_stock()
+
+    def test_a_demand_is_split_across_batches_in_fefo_order(self):
+        allocations = allocate_stock(self.owner, [self.demand(8)], strategy="fefo")
+
+        self.assertEqual([(inventory.batch_id, taken) for inventory, taken in allocations], [
+            (self.early.pk, Decimal("5")), (self.late.pk, Decimal("3")),
+        ])
+        self.assertEqual(self.quantity(self.early), Decimal("0"))
+        self.assertEqual(self.quantity(self.late), Decimal("7"))
+        self.assertEqual(InventoryLog.objects.filter(log_type="sale").count(), 2)
+        self.assertEqual(StockLevel.objects.get(product=self.product).quantity, Decimal("7"))
+
+    def test_insufficient_stock_writes_nothing(self):
+        with self.assertRaises(InsufficientStockError):
+            allocate_stock(self.owner, [self.demand(5), self.demand(11)])
+
+        self.assertEqual(self.quantity(self.early), Decimal("5"))
+        self.assertEqual(self.quantity(self.late), Decimal("10"))
+        self.assertFalse(InventoryLog.objects.filter(log_type="sale").exists())
+        self.assertEqual(StockLevel.objects.get(product=self.product).quantity, Decimal("15"))
+
+    def test_expired_batches_are_not_sold(self):
+        Batch.objects.filter(pk=self.early.pk).update(expiry_date=timezone.now().date() - timedelta(days=1))
+
+        allocate_stock(self.owner, [self.demand(4)])
+
+        self.assertEqual(self.quantity(self.early), Decimal("5"))
+        self.assertEqual(self.quantity(self.late), Decimal("6"))
+        with self.assertRaises(InsufficientStockError):
+            allocate_stock(self.owner, [self.demand(7)])
+
+
+class ConcurrentAllocationTests(StockTestData, TransactionTestCase):
+    """
+    Sales racing for the same rows on separate connections must never oversell.
+    """
+    workers = 20
+
+    def setUp(self):
+        self.create_stock()
+
+    def test_concurrent_allocations_never_oversell(self):
+        results = []
+        start = threading.Barrier(self.workers)
+
+        def sell():
+            try:
+                start.wait()
+                allocate_stock(self.owner, [self.demand(1)])
+                results.append("sold")
+            except InsufficientStockError:
+                results.append("short")
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=sell) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count("sold"), 15)
+        self.assertEqual(results.count("short"), self.workers - 15)
+        self.assertEqual(self.quantity(self.early) + self.quantity(self.late), Decimal("0"))
+        self.assertEqual(StockLevel.objects.get(product=self.product).quantity, Decimal("0"))
+        self.assertEqual(InventoryLog.objects.filter(log_type="sale").count(), 15)
+
+
+class ConsumeChangesTests(StockTestData, TransactionTestCase):
+    def setUp(self):
+        self.create_stock()
+        self.inventory = Inventory.objects.get(product=self.product, batch=self.early)
+
+    def log(self, reason):
+        return InventoryLog.objects.create(inventory=self.inventory, change_quantity=1, reason=reason)
+
+    def consume(self):
+        seen = []
+        consume_changes(
+            "test", InventoryLog.objects.filter(log_type="adjustment").values('txid', 'id', 'reason'),
+            lambda page: seen.extend(row['reason'] for row in page), page_size=2, from_start=True,
+        )
+        return seen
+
+    def test_changes_follow_commit_order_and_wait_for_open_transactions(self):
+        seen_while_open = []
+
+        def commit_later_change():
+            try:
+                self.log("b")
+                seen_while_open.extend(self.consume())
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            self.log("a")
+            # Committed while the transaction of "a" is still open, so with a later txid
+            thread = threading.Thread(target=commit_later_change)
+            thread.start()
+            thread.join()
+            self.log("c")
+
+        self.assertEqual(seen_while_open, [])
+        self.assertEqual(self.consume(), ["a", "c", "b"])
+        self.assertEqual(self.consume(), [])
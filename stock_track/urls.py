@@ -41,4 +41,8 @@ urlpatterns = [
     path('inventories/create/', views.inventory_create, name='inventory_create'),
     path('inventories/<int:id>/update/', views.inventory_update, name='inventory_update'),
     path('inventories/<int:id>/delete/', views.inventory_delete, name='inventory_delete'),
+    path('inventories/transfer/', views.inventory_transfer, name='inventory_transfer'),
+    path('inventories/receive/', views.inventory_receive, name='inventory_receive'),
+    path('inventories/import/', views.inventory_import, name='inventory_import'),
+    path('inventories/balance/', views.inventory_balance_api, name='inventory_balance_api'),
 ]
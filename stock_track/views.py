@@ -1,8 +1,19 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponseForbidden
+from django.http import HttpResponseForbidden, JsonResponse
 from django.contrib.auth.decorators import login_required
+from django.contrib import messages
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
+from zipfile import BadZipFile
 from .models import *
 from .forms import *
+from .alerts import record_threshold_crossings
+from .services import ReceiptLine, receive_stock, transfer_stock
+from .snapshots import inventory_balances_at
+from .importer import import_catalogue
 
 
 def index(request):
@@ -210,7 +221,11 @@ def delete_warehouse(request, id):
 
 # List Products
 def product_list(request):
-    products = Product.objects.filter(company_owner=request.user)
+    products = Product.objects.filter(company_owner=request.user).annotate(
+        stock_on_hand=Subquery(
+            ProductStockLevel.objects.filter(product=OuterRef('pk')).values('quantity')[:1]
+        )
+    )
     return render(request, 'stock_track/product_list.html', {'products': products})
 
 
@@ -284,26 +299,151 @@ def delete_product(request, id):
 
 ############################### Inventory Processing
 
+INVENTORY_PAGE_SIZE = 50
+
+
 def inventory_list(request):
-    inventories = Inventory.objects.filter(company_owner=request.user)
-    return render(request, "stock_track/inventory_list.html", {"inventories": inventories})
+    """
+    Inventory rows newest first, paginated by keyset (rows with an id below the last one shown)
+    instead of offsets, so every page costs the same however deep the user scrolls.
+    """
+    inventories = (
+        Inventory.objects.filter(company_owner=request.user)
+        .select_related('product', 'product_variation', 'batch', 'warehouse')
+        .order_by('-id')
+    )
+
+    # Filters
+    warehouse_id = request.GET.get("warehouse", "")
+    product_id = request.GET.get("product", "")
+    expires_within = request.GET.get("expires_within", "")
+    low_stock = request.GET.get("low_stock") == "1"
+    if warehouse_id.isdigit():
+        inventories = inventories.filter(warehouse_id=warehouse_id)
+    if product_id.isdigit():
+        inventories = inventories.filter(product_id=product_id)
+    if expires_within.isdigit():
+        today = timezone.now().date()
+        inventories = inventories.filter(
+            batch__expiry_date__gte=today,
+            batch__expiry_date__lte=today + timedelta(days=int(expires_within)),
+        )
+    if low_stock:
+        inventories = inventories.filter(quantity__lt=F('product__stock_alert_threshold'))
+
+    # Keyset pagination
+    after = request.GET.get("after", "")
+    if after.isdigit():
+        inventories = inventories.filter(id__lt=after)
+    page = list(inventories[:INVENTORY_PAGE_SIZE + 1])
+    next_query = None
+    if len(page) > INVENTORY_PAGE_SIZE:
+        page = page[:INVENTORY_PAGE_SIZE]
+        query = request.GET.copy()
+        query["after"] = page[-1].id
+        next_query = query.urlencode()
+    first_query = request.GET.copy()
+    first_query.pop("after", None)
+
+    context = {
+        "inventories": page,
+        "warehouses": Warehouse.objects.filter(company_owner=request.user).order_by('name'),
+        "products": Product.objects.filter(company_owner=request.user).order_by('name').only('id', 'name'),
+        "filters": {
+            "warehouse": warehouse_id,
+            "product": product_id,
+            "expires_within": expires_within,
+            "low_stock": low_stock,
+        },
+        "next_query": next_query,
+        "first_query": first_query.urlencode() if after else None,
+    }
+    return render(request, "stock_track/inventory_list.html", context)
 
 
 def inventory_create(request):
     
-    form = InventoryForm(company_owner=request.user)
+    form = InventoryReceiptForm(company_owner=request.user)
     if request.method == "POST":
-        form = InventoryForm(request.POST, company_owner=request.user)
+        form = InventoryReceiptForm(request.POST, company_owner=request.user)
         if form.is_valid():
-            inventory = form.save(commit=False)
-            inventory.company_owner = request.user
-            inventory.save()
-            return redirect("stock_track:inventory_list")
-    else:
-        form = InventoryForm(company_owner=request.user)
+            # Adding stock that already has a row (same product, variation, batch and warehouse) adds to it
+            line = ReceiptLine(
+                form.cleaned_data["product"].id,
+                form.cleaned_data["product_variation"].id if form.cleaned_data["product_variation"] else None,
+                form.cleaned_data["batch"].id,
+                form.cleaned_data["quantity"],
+            )
+            try:
+                receive_stock(request.user, form.cleaned_data["warehouse"], [line])
+            except ValueError as e:
+                messages.error(request, str(e))
+            else:
+                return redirect("stock_track:inventory_list")
     return render(request, "stock_track/inventory_form.html", {"form": form})
 
 
+def inventory_receive(request):
+    form = GoodsReceiptForm(company_owner=request.user)
+    line_formset = ReceiptLineFormSet(form_kwargs={"company_owner": request.user})
+
+    if request.method == "POST":
+        form = GoodsReceiptForm(request.POST, company_owner=request.user)
+        line_formset = ReceiptLineFormSet(request.POST, form_kwargs={"company_owner": request.user})
+
+        if form.is_valid() and line_formset.is_valid():
+            lines = [
+                ReceiptLine(
+                    line["product"].id,
+                    line["product_variation"].id if line["product_variation"] else None,
+                    line["batch"].id,
+                    line["quantity"],
+                )
+                for line in line_formset.cleaned_data
+                if line
+            ]
+            try:
+                count = receive_stock(
+                    request.user, form.cleaned_data["warehouse"], lines, reason=form.cleaned_data["reason"]
+                )
+            except ValueError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, f"Received {count} inventory line(s).")
+                return redirect("stock_track:inventory_list")
+
+    return render(
+        request,
+        "stock_track/receipt_form.html",
+        {"form": form, "line_formset": line_formset},
+    )
+
+
+# Products, variations, batches and stock from a CSV/XLSX spreadsheet
+def inventory_import(request):
+    form = CatalogueImportForm()
+    result = None
+
+    if request.method == "POST":
+        form = CatalogueImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data["file"]
+            try:
+                result = import_catalogue(request.user, upload.file, upload.name)
+            except (ValueError, BadZipFile) as e:
+                # Chunks imported before the file turned out unreadable stay imported
+                messages.error(request, f"Import stopped, the file could not be read: {e}")
+            else:
+                errors = result.pop("errors")
+                if errors:
+                    messages.warning(request, f"{len(errors)} row(s) could not be imported.")
+                else:
+                    messages.success(request, f"Imported {result['rows']} row(s).")
+                result = {"counts": result, "errors": errors[:500], "error_count": len(errors)}
+
+    return render(request, "stock_track/import_form.html", {"form": form, "result": result})
+
+
 def inventory_update(request, id):
     
     inventory = get_object_or_404(Inventory, id=id, company_owner=request.user)
@@ -316,19 +456,25 @@ def inventory_update(request, id):
         log_form = InventoryLogForm(request.POST)
 
         if inventory_form.is_valid() and log_form.is_valid():
-            # Save inventory changes
-            updated_inventory = inventory_form.save(commit=False)
-            updated_inventory.company_owner = request.user
-            updated_inventory.save()
-
-            # Calculate quantity change
-            change_quantity = updated_inventory.quantity - previous_quantity
-
-            # Save inventory log
-            log = log_form.save(commit=False)
-            log.inventory = updated_inventory
-            log.change_quantity = change_quantity
-            log.save()
+            with transaction.atomic():
+                # Save inventory changes
+                updated_inventory = inventory_form.save(commit=False)
+                updated_inventory.company_owner = request.user
+                updated_inventory.save()
+
+                # Calculate quantity change
+                change_quantity = updated_inventory.quantity - previous_quantity
+
+                # Save inventory log
+                log = log_form.save(commit=False)
+                log.inventory = updated_inventory
+                log.change_quantity = change_quantity
+                log.save()
+
+                # Queue a stock alert if the edit crossed the product's threshold
+                record_threshold_crossings([
+                    (updated_inventory, previous_quantity, updated_inventory.product.stock_alert_threshold)
+                ])
 
             return redirect("stock_track:inventory_list")
     else:
@@ -347,3 +493,81 @@ def inventory_delete(request, id):
     inventory.delete()
     return redirect("stock_track:inventory_list")
 
+
+
+def inventory_transfer(request):
+    form = StockTransferForm(company_owner=request.user)
+    line_formset = TransferLineFormSet(form_kwargs={"company_owner": request.user})
+
+    if request.method == "POST":
+        form = StockTransferForm(request.POST, company_owner=request.user)
+        line_formset = TransferLineFormSet(request.POST, form_kwargs={"company_owner": request.user})
+
+        if form.is_valid() and line_formset.is_valid():
+            lines = [
+                (line["inventory"].id, line["quantity"])
+                for line in line_formset.cleaned_data
+                if line
+            ]
+            try:
+                transfer_stock(
+                    request.user,
+                    form.cleaned_data["from_warehouse"],
+                    form.cleaned_data["to_warehouse"],
+                    lines,
+                    note=form.cleaned_data["note"],
+                )
+            except ValueError as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, "Stock transferred successfully.")
+                return redirect("stock_track:inventory_list")
+
+    return render(
+        request,
+        "stock_track/transfer_form.html",
+        {"form": form, "line_formset": line_formset},
+    )
+
+
+# Stock on hand at a past moment, e.g. ?at=2024-01-31 for month end (a bare date means the end of that day)
+@login_required
+def inventory_balance_api(request):
+    at_param = request.GET.get("at") or ""
+    at = parse_datetime(at_param)
+    if at is None and parse_date(at_param):
+        at = datetime.combine(parse_date(at_param), time.max)
+    if at is None:
+        return JsonResponse({"errors": ["'at' must be a date or a datetime."]}, status=400)
+    if timezone.is_naive(at):
+        at = timezone.make_aware(at)
+
+    inventories = Inventory.objects.all()
+    warehouse_id = request.GET.get("warehouse", "")
+    if warehouse_id:
+        if not warehouse_id.isdigit():
+            return JsonResponse({"errors": ["'warehouse' must be a warehouse id."]}, status=400)
+        inventories = inventories.filter(warehouse_id=warehouse_id)
+
+    balances = inventory_balances_at(request.user, at, inventories)
+    rows = Inventory.objects.filter(id__in=balances).select_related(
+        "product", "product_variation", "warehouse", "batch"
+    ).order_by("id")
+
+    items = []
+    total_value = 0
+    for inventory in rows:
+        quantity = balances[inventory.id]
+        price = inventory.product_variation.price if inventory.product_variation else inventory.product.price
+        total_value += quantity * price
+        items.append({
+            "inventory_id": inventory.id,
+            "product": inventory.product.name,
+            "variation": inventory.product_variation.name if inventory.product_variation else None,
+            "warehouse": inventory.warehouse.name,
+            "batch": inventory.batch.batch_number,
+            "quantity": str(quantity),
+            "value": str(quantity * price),
+        })
+
+    return JsonResponse({"at": at.isoformat(), "items": items, "total_value": str(total_value)})